@@ -0,0 +1,257 @@
+"""Analysis schema, tolerant JSON parsing and the typed analysis record."""
+import json
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+
+SENTIMENTS = ("positive", "negative", "neutral", "mixed")
+
+# Response schema: sent through JSON mode on Gemini models, in the prompt on others
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string"},
+        "topics": {"type": "array", "items": {"type": "string"}},
+        "entities": {"type": "array", "items": {"type": "string"}},
+        "category": {"type": "string"},
+        "sentiment": {"type": "string", "enum": list(SENTIMENTS)},
+        "action_items": {"type": "array", "items": {"type": "string"}},
+        "key_points": {"type": "array", "items": {"type": "string"}},
+        "confidence": {"type": "number"},
+    },
+    "required": ["summary", "category", "topics"],
+}
+
+
+class AnalysisParseError(ValueError):
+    """Model answered, but not with a usable analysis."""
+
+    def __init__(self, message, raw_response=""):
+        super().__init__(message)
+        self.raw_response = raw_response
+
+
+class StreamingJSONParser:
+    """Incremental JSON object parser that can close truncated output.
+
+    Feed it text as it arrives; anything before the first "{" (such as a
+    ```json fence) and after the matching "}" is ignored. `value()` returns
+    the parsed object, repairing an unterminated tail by cutting back to the
+    last complete member and closing open arrays and objects. A value cut off
+    inside a string is dropped rather than kept partial.
+    """
+
+    def __init__(self):
+        self._chars = []
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._done = False
+        # (length, closers) pairs where the buffer can be cut and closed
+        self._cuts = []
+
+    @property
+    def complete(self):
+        return self._done
+
+    @property
+    def truncated(self):
+        return bool(self._chars) and not self._done
+
+    def feed(self, chunk):
+        for ch in chunk:
+            if self._done:
+                return
+            if not self._stack:
+                if ch == "{":
+                    self._open(ch)
+                continue
+            self._chars.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._open(ch)
+            elif ch in "}]":
+                self._stack.pop()
+                if not self._stack:
+                    self._done = True
+            elif ch == ",":
+                self._cuts.append((len(self._chars) - 1, self._closers()))
+
+    def _open(self, ch):
+        if not self._stack:
+            self._chars.append(ch)
+        self._stack.append("}" if ch == "{" else "]")
+        self._cuts.append((len(self._chars), self._closers()))
+
+    def _closers(self):
+        return "".join(reversed(self._stack))
+
+    def text(self):
+        """Best-effort complete JSON text for what has been fed so far."""
+        raw = "".join(self._chars)
+        if self._done or not raw:
+            return raw
+        if self._in_string:
+            # Truncated mid-string: "category": "Id would be kept as "Id"
+            length, closers = self._cuts[-1]
+            return raw[:length].rstrip().rstrip(",") + closers
+        return raw.rstrip().rstrip(",") + self._closers()
+
+    def value(self):
+        """Parse the buffer, cutting back to earlier members if needed."""
+        if not self._chars:
+            raise json.JSONDecodeError("No JSON object found", "", 0)
+        candidates = [self.text()]
+        if not self._done:
+            raw = "".join(self._chars)
+            candidates += [raw[:length].rstrip().rstrip(",") + closers
+                           for length, closers in reversed(self._cuts)]
+        error = None
+        for candidate in candidates:
+            try:
+                return json.loads(candidate)
+            except json.JSONDecodeError as e:
+                error = error or e
+        raise error
+
+
+def parse_json_object(text):
+    """Parse a JSON object from model output, repairing truncation.
+
+    Returns (obj, repaired).
+    """
+    parser = StreamingJSONParser()
+    parser.feed(text)
+    return parser.value(), parser.truncated
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [v.strip() for v in value.split(",") if v.strip()]
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value if v is not None and str(v).strip()]
+    return [str(value)]
+
+
+def _as_text(value):
+    if value is None:
+        return None
+    text = str(value).strip()
+    return text or None
+
+
+@dataclass
+class AnalysisRecord:
+    """Validated result of analyze_content, stored as ai_analysis."""
+
+    summary: str = None
+    category: str = None
+    topics: list = field(default_factory=list)
+    entities: list = field(default_factory=list)
+    sentiment: str = None
+    action_items: list = field(default_factory=list)
+    key_points: list = field(default_factory=list)
+    confidence: float = None
+    repaired: bool = False
+
+    @classmethod
+    def from_dict(cls, data, repaired=False):
+        """Coerce a loosely typed model answer into a record.
+
+        Raises ValueError when the answer has neither summary nor category.
+        """
+        if not isinstance(data, dict):
+            raise ValueError(f"Expected a JSON object, got {type(data).__name__}")
+        sentiment = _as_text(data.get("sentiment"))
+        if sentiment is not None:
+            sentiment = sentiment.lower()
+            if sentiment not in SENTIMENTS:
+                sentiment = None
+        confidence = data.get("confidence")
+        try:
+            confidence = min(1.0, max(0.0, float(confidence))) if confidence is not None else None
+        except (TypeError, ValueError):
+            confidence = None
+        record = cls(
+            summary=_as_text(data.get("summary")),
+            category=_as_text(data.get("category")),
+            topics=_as_list(data.get("topics")),
+            entities=_as_list(data.get("entities")),
+            sentiment=sentiment,
+            action_items=_as_list(data.get("action_items")),
+            key_points=_as_list(data.get("key_points")),
+            confidence=confidence,
+            repaired=repaired,
+        )
+        if not record.summary and not record.category:
+            raise ValueError("Analysis has neither summary nor category")
+        return record
+
+    def to_dict(self):
+        """Dict for ai_analysis, leaving out fields the model did not fill."""
+        data = {k: v for k, v in asdict(self).items()
+                if k != "repaired" and v is not None and v != []}
+        if self.repaired:
+            data["_repaired"] = True
+        return data
+
+
+def parse_analysis(text):
+    """Parse and validate model output into an AnalysisRecord."""
+    data, repaired = parse_json_object(text)
+    return AnalysisRecord.from_dict(data, repaired=repaired)
+
+
+def _merge_lists(lists, limit):
+    """Union of lists, most frequent first, case-insensitive dedupe."""
+    counts = Counter()
+    first_seen = {}
+    for items in lists:
+        for item in items:
+            key = item.lower()
+            counts[key] += 1
+            first_seen.setdefault(key, item)
+    order = {key: i for i, key in enumerate(first_seen)}
+    ranked = sorted(counts, key=lambda k: (-counts[k], order[k]))
+    return [first_seen[k] for k in ranked[:limit]]
+
+
+def merge_records(records, weights=None):
+    """Reduce per-section analyses of one document into a single record.
+
+    Category is a weighted vote, sentiment becomes "mixed" when sections
+    disagree, and list fields are merged and ranked by how many sections
+    mention them. The summary is a placeholder joined from the sections;
+    callers usually replace it with a model-written one.
+    """
+    if not records:
+        raise ValueError("Nothing to merge")
+    weights = weights or [1] * len(records)
+
+    votes = Counter()
+    for record, weight in zip(records, weights):
+        if record.category:
+            votes[record.category] += weight
+    sentiments = {r.sentiment for r in records if r.sentiment}
+    confidences = [r.confidence for r in records if r.confidence is not None]
+
+    return AnalysisRecord(
+        summary=" ".join(r.summary for r in records if r.summary)[:500] or None,
+        category=votes.most_common(1)[0][0] if votes else None,
+        topics=_merge_lists([r.topics for r in records], 10),
+        entities=_merge_lists([r.entities for r in records], 20),
+        sentiment=sentiments.pop() if len(sentiments) == 1 else ("mixed" if sentiments else None),
+        action_items=_merge_lists([r.action_items for r in records], 20),
+        key_points=_merge_lists([r.key_points for r in records], 10),
+        confidence=min(confidences) if confidences else None,
+        repaired=any(r.repaired for r in records),
+    )
@@ -0,0 +1,307 @@
+"""Headless HTTP API for programmatic ingest and search.
+
+    python api.py [--secrets .streamlit/secrets.toml] [--port 8080]
+
+Uses the same pipeline (dedupe, analysis, embeddings, search) as the
+Streamlit app. Configure under [api] in secrets.toml:
+
+    [api]
+    keys = ["long-random-token"]      # sent as "Authorization: Bearer <key>"
+    user_id = "<uuid>"                # owner of entries ingested through the API
+    max_concurrency = 16              # pipeline calls running at once
+    max_pending = 200                 # queued calls before answering 429
+    max_batch = 100                   # entries per batch request
+
+Endpoints:
+    POST /v1/entries         {"content": ..., "file_type": ..., "file_name": ...}
+    POST /v1/entries/batch   {"entries": [{...}, ...]}
+    POST /v1/search          {"query": ..., "limit": 10, "filters": {...}}
+    POST /v1/search/batch    {"queries": [{...}, ...]}
+    GET  /v1/suggest?q=mach&limit=8&kinds=topic,entity
+    GET  /v1/stats
+    GET  /healthz
+"""
+import argparse
+import asyncio
+import hmac
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from pipeline import Pipeline
+from settings import load_secrets
+from suggest import KINDS
+
+DEFAULT_API = {
+    "keys": [],
+    "user_id": None,
+    "max_concurrency": 16,
+    "max_pending": 200,
+    "max_batch": 100,
+    "max_search_limit": 50,
+    "max_suggest_limit": 20,
+}
+
+FILTER_KEYS = ("include_archived", "category", "file_type", "created_after", "created_before", "user_id")
+
+
+class Overloaded(Exception):
+    """Too many calls are already waiting."""
+
+
+class Limiter:
+    """Bound concurrent pipeline calls and reject work beyond a queue limit.
+
+    Blocking pipeline calls run in a thread pool sized to max_concurrency,
+    so one pooled model client and database client serve every request.
+    """
+
+    def __init__(self, max_concurrency, max_pending):
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="pipeline")
+        self.pending = 0
+        self.running = 0
+
+    def reserve(self, count=1):
+        """Claim queue slots for `count` calls, or raise Overloaded."""
+        if self.pending + count > self.max_pending:
+            raise Overloaded()
+        self.pending += count
+
+    async def run(self, fn, *args):
+        """Run fn in the pool once a slot is free. Call reserve() first."""
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.pending -= 1
+        self.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+
+
+def _error(status, message, **headers):
+    return web.json_response({"error": message}, status=status, headers=headers)
+
+
+@web.middleware
+async def auth_middleware(request, handler):
+    if request.path == "/healthz":
+        return await handler(request)
+    keys = request.app["settings"]["keys"]
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+    if not keys or not any(hmac.compare_digest(token, key) for key in keys):
+        return _error(401, "Invalid or missing API key")
+    try:
+        return await handler(request)
+    except Overloaded:
+        return _error(429, "Too many pending requests", **{"Retry-After": "5"})
+
+
+async def _json(request):
+    try:
+        return await request.json()
+    except Exception:
+        raise web.HTTPBadRequest(text="Body must be JSON")
+
+
+def _entry_args(item, user_id):
+    content = str(item.get("content") or "").strip() if isinstance(item, dict) else ""
+    if not content:
+        raise ValueError("content is required")
+    return (user_id, content, item.get("file_type"), item.get("file_name"), item.get("file_info"))
+
+
+def _search_args(item, max_limit):
+    query = str(item.get("query") or "").strip() if isinstance(item, dict) else ""
+    if not query:
+        raise ValueError("query is required")
+    limit = max(1, min(int(item.get("limit", 10)), max_limit))
+    filters = item.get("filters") or {}
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be an object")
+    filters = {k: v for k, v in filters.items() if k in FILTER_KEYS}
+    return (query, limit, filters)
+
+
+def _ingest_result(outcome):
+    success, message, ai_analysis = outcome
+    return {"ok": success, "message": message, "ai_analysis": ai_analysis}
+
+
+async def ingest(request):
+    item = await _json(request)
+    try:
+        args = _entry_args(item, request.app["settings"]["user_id"])
+    except ValueError as e:
+        return _error(400, str(e))
+    limiter = request.app["limiter"]
+    limiter.reserve()
+    try:
+        outcome = await limiter.run(request.app["pipeline"].ingest_entry, *args)
+    except Exception as e:
+        return _error(502, f"Ingest error: {e}")
+    return web.json_response(_ingest_result(outcome), status=201 if outcome[0] else 502)
+
+
+async def ingest_batch(request):
+    body = await _json(request)
+    items = body.get("entries") if isinstance(body, dict) else None
+    settings = request.app["settings"]
+    if not isinstance(items, list) or not items:
+        return _error(400, "entries must be a non-empty list")
+    if len(items) > settings["max_batch"]:
+        return _error(413, f"At most {settings['max_batch']} entries per batch")
+
+    results = [None] * len(items)
+    valid = []
+    for i, item in enumerate(items):
+        try:
+            valid.append((i, _entry_args(item, settings["user_id"])))
+        except ValueError as e:
+            results[i] = {"ok": False, "message": str(e)}
+
+    limiter = request.app["limiter"]
+    limiter.reserve(len(valid))
+    outcomes = await asyncio.gather(
+        *(limiter.run(request.app["pipeline"].ingest_entry, *args) for _, args in valid),
+        return_exceptions=True,
+    )
+    for (i, _), outcome in zip(valid, outcomes):
+        if isinstance(outcome, Exception):
+            results[i] = {"ok": False, "message": f"Error: {outcome}"}
+        else:
+            results[i] = _ingest_result(outcome)
+    return web.json_response({"results": results, "saved": sum(1 for r in results if r["ok"])})
+
+
+async def search(request):
+    item = await _json(request)
+    try:
+        args = _search_args(item, request.app["settings"]["max_search_limit"])
+    except (TypeError, ValueError) as e:
+        return _error(400, str(e))
+    limiter = request.app["limiter"]
+    limiter.reserve()
+    try:
+        results = await limiter.run(request.app["pipeline"].search_entries, *args)
+    except Exception as e:
+        return _error(502, f"Search error: {e}")
+    return web.json_response({"results": results}, dumps=_dumps)
+
+
+async def search_batch(request):
+    body = await _json(request)
+    items = body.get("queries") if isinstance(body, dict) else None
+    settings = request.app["settings"]
+    if not isinstance(items, list) or not items:
+        return _error(400, "queries must be a non-empty list")
+    if len(items) > settings["max_batch"]:
+        return _error(413, f"At most {settings['max_batch']} queries per batch")
+    try:
+        arg_list = [_search_args(item, settings["max_search_limit"]) for item in items]
+    except (TypeError, ValueError) as e:
+        return _error(400, str(e))
+
+    limiter = request.app["limiter"]
+    limiter.reserve(len(arg_list))
+    fn = request.app["pipeline"].search_entries
+    outcomes = await asyncio.gather(*(limiter.run(fn, *args) for args in arg_list), return_exceptions=True)
+    results = [
+        {"error": f"Search error: {o}"} if isinstance(o, Exception) else {"results": o}
+        for o in outcomes
+    ]
+    return web.json_response({"results": results}, dumps=_dumps)
+
+
+async def suggest(request):
+    pipeline = request.app["pipeline"]
+    settings = request.app["settings"]
+    try:
+        limit = max(1, min(int(request.query.get("limit", 8)), settings["max_suggest_limit"]))
+    except ValueError:
+        return _error(400, "limit must be an integer")
+    kinds = [k for k in request.query.get("kinds", "").split(",") if k]
+    if any(k not in KINDS for k in kinds):
+        return _error(400, f"kinds must be among {', '.join(KINDS)}")
+    args = (request.query.get("q", ""), limit, kinds or None)
+    # Answered in memory on the event loop; only the first build leaves it
+    if not pipeline.suggestions_ready:
+        await asyncio.get_running_loop().run_in_executor(None, lambda: pipeline.suggest_index)
+    return web.json_response({"suggestions": pipeline.suggest(*args)})
+
+
+async def stats(request):
+    pipeline = request.app["pipeline"]
+    limiter = request.app["limiter"]
+    return web.json_response({
+        "routes": pipeline.router.stats(),
+        "upstream": [g.stats() for g in pipeline.router.guards.values()] + [pipeline.embed_guard.stats()],
+        "changes": pipeline.changes.stats(),
+        "running": limiter.running,
+        "pending": limiter.pending,
+    })
+
+
+async def healthz(request):
+    return web.json_response({"ok": True})
+
+
+def _dumps(data):
+    return json.dumps(data, default=str)
+
+
+def _warm_suggestions(pipeline):
+    try:
+        pipeline.suggest_index
+    except Exception as e:
+        print(f"Suggestion index build failed: {e}")
+
+
+def create_app(pipeline, settings):
+    settings = {**DEFAULT_API, **settings}
+    app = web.Application(middlewares=[auth_middleware], client_max_size=20 * 1024 * 1024)
+    app["pipeline"] = pipeline
+    app["settings"] = settings
+
+    async def start_limiter(app):
+        app["limiter"] = Limiter(settings["max_concurrency"], settings["max_pending"])
+        pipeline.changes.start()
+        # Build the suggestion index in the background so the first request is fast
+        asyncio.get_running_loop().run_in_executor(None, _warm_suggestions, pipeline)
+
+    async def stop_changes(app):
+        pipeline.changes.stop()
+
+    app.on_startup.append(start_limiter)
+    app.on_cleanup.append(stop_changes)
+    app.router.add_post("/v1/entries", ingest)
+    app.router.add_post("/v1/entries/batch", ingest_batch)
+    app.router.add_post("/v1/search", search)
+    app.router.add_post("/v1/search/batch", search_batch)
+    app.router.add_get("/v1/suggest", suggest)
+    app.router.add_get("/v1/stats", stats)
+    app.router.add_get("/healthz", healthz)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KnowledgeHub ingest and search API")
+    parser.add_argument("--secrets", help="path to secrets.toml")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    secrets = load_secrets(args.secrets)
+    settings = dict(secrets.get("api", {}))
+    if not settings.get("user_id"):
+        parser.error("[api] user_id must be set in secrets.toml")
+    web.run_app(create_app(Pipeline.from_secrets(secrets), settings), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,13 +3,17 @@ import streamlit.components.v1
 from streamlit_option_menu import option_menu
 from supabase import create_client, Client
 import google.generativeai as genai
-from datetime import datetime
+from datetime import timedelta
 import pandas as pd
 from PIL import Image
 import io
 import json
 import time
-import re
+from csv_import import import_csv, summarize_csv
+from embeddings import ReEmbedder, embed_text
+from entry_graph import GraphBuilder, GraphRefresher
+from pipeline import Pipeline
+from tokens import truncate_tokens
 
 # Configure page
 st.set_page_config(page_title="KnowledgeHub", page_icon="💡", layout="wide")
@@ -25,8 +29,26 @@ supabase = init_supabase()
 
 # Initialize Gemini
 genai.configure(api_key=st.secrets["gemini"]["api_key"])
-MODEL_NAME = "gemma-3-27b-it"
-model = genai.GenerativeModel(MODEL_NAME)
+
+# Save/analyze/embed/search pipeline, shared by all sessions. Configured from
+# secrets.toml: [models], [resilience], [analysis], [embeddings], [search], [dedupe],
+# [changefeed]. Its change feed polls for writes made by other processes.
+@st.cache_resource
+def init_pipeline():
+    pipeline = Pipeline(supabase, st.secrets)
+    pipeline.changes.start()
+    return pipeline
+
+pipeline = init_pipeline()
+router = pipeline.router
+embed_guard = pipeline.embed_guard
+MODEL_NAME = pipeline.model_name
+MAX_CONTENT_TOKENS = pipeline.max_content_tokens
+EMBEDDINGS = pipeline.embeddings
+EMBEDDING, NEXT_EMBEDDING = pipeline.embedding, pipeline.next_embedding
+FILE_TYPES = ["text", "csv", "xlsx", "pdf", "image"]
+# CSV files are read in chunks; see csv_import.DEFAULT_CSV
+CSV_SETTINGS = dict(st.secrets.get("csv", {}))
 
 # Allowed users (configure in secrets.toml under [access])
 ALLOWED_EMAILS = st.secrets.get("access", {}).get("allowed_emails", [])
@@ -183,59 +205,11 @@ check_authentication()
 # AI Functions
 def analyze_content(content, file_info=None):
     """Use Gemini to analyze and extract metadata from content"""
-    prompt = f"""Analyze the following content and extract structured information.
-Return a JSON object with these fields (include only what you can identify):
-- summary: Brief 1-2 sentence summary
-- topics: Array of main topics/themes
-- entities: Array of named entities (people, companies, products, etc.)
-- category: Best fitting category (e.g., "Feedback", "Idea", "Bug Report", "Meeting Notes", "Research", "Question", "Documentation", etc.)
-- sentiment: "positive", "negative", "neutral", or "mixed"
-- action_items: Array of any action items or tasks mentioned
-- key_points: Array of main takeaways
-
-Content:
-{content}
-
-{f"File info: {file_info}" if file_info else ""}
-
-Respond with ONLY valid JSON, no markdown formatting."""
-    
-    try:
-        response = model.generate_content(prompt)
-        text = response.text.strip()
-        # Remove markdown code blocks if present
-        if text.startswith("```"):
-            lines = text.split("\n")
-            # Remove first line (```json) and last line (```)
-            text = "\n".join(lines[1:-1])
-        elif text.startswith("`"):
-            text = text.strip("`")
-        
-        result = json.loads(text)
-        return result
-    except json.JSONDecodeError as e:
-        # Try to extract JSON from response
-        import re
-        json_match = re.search(r'\{[\s\S]*\}', response.text)
-        if json_match:
-            try:
-                return json.loads(json_match.group())
-            except:
-                pass
-        return {"error": f"JSON parse error: {str(e)}", "raw_response": response.text[:500], "summary": content[:200]}
-    except Exception as e:
-        return {"error": f"Model: {MODEL_NAME} - {str(e)}", "summary": content[:200]}
+    return pipeline.analyze_content(content, file_info)
 
 def analyze_image(image):
     """Analyze image using Gemini Vision"""
-    try:
-        response = model.generate_content([
-            "Describe this image in detail. Extract any text visible. Identify what type of content this is.",
-            image
-        ])
-        return response.text
-    except Exception as e:
-        return f"Error analyzing image: {e}"
+    return pipeline.analyze_image(image)
 
 def analyze_csv(df):
     """Analyze CSV/Excel content"""
@@ -270,59 +244,117 @@ def read_pdf(uploaded_file):
     except Exception as e:
         return f"Error reading PDF: {e}"
 
-def generate_embedding(text):
+def generate_embedding(text, spec=None):
     """Generate embedding for semantic search"""
-    try:
-        result = genai.embed_content(
-            model="models/gemini-embedding-001",
-            content=text[:5000],
-            task_type="retrieval_document"
-        )
-        return result['embedding']
-    except Exception as e:
-        print(f"Embedding error: {e}")
-        return None
+    return pipeline.generate_embedding(text, spec)
+
+@st.cache_resource
+def init_re_embedder():
+    """One background re-embedder per process."""
+    return ReEmbedder(
+        supabase, NEXT_EMBEDDING,
+        lambda text, spec: embed_text(text, spec, guard=embed_guard),
+        rate_per_minute=EMBEDDINGS["rate_per_minute"],
+        batch_size=EMBEDDINGS["batch_size"],
+    )
 
 def save_entry(content, ai_analysis, file_type=None, file_name=None):
     """Save entry to Supabase"""
-    embedding = generate_embedding(content)
-    
-    data = {
-        "user_id": st.session_state.user.user.id,
-        "content": content,
-        "ai_analysis": ai_analysis,
-        "file_type": file_type,
-        "file_name": file_name,
-        "embedding": embedding,
-        "created_at": datetime.utcnow().isoformat()
-    }
-    
-    try:
-        result = supabase.table("entries").insert(data).execute()
-        return True, "Saved!"
-    except Exception as e:
-        return False, f"Error: {e}"
+    return pipeline.save_entry(st.session_state.user.user.id, content, ai_analysis, file_type, file_name)
 
-def search_entries(query, limit=10):
+def ingest_entry(content, file_type=None, file_name=None, file_info=None):
+    """Dedupe, analyze, embed and save content. Returns (success, message, ai_analysis)."""
+    return pipeline.ingest_entry(st.session_state.user.user.id, content, file_type, file_name, file_info)
+
+def search_entries(query, limit=10, filters=None):
     """Search entries using semantic similarity"""
-    query_embedding = generate_embedding(query)
-    
-    if query_embedding is None:
-        return []
-    
+    return pipeline.search_entries(query, limit, filters,
+                                   on_error=lambda e: st.error(f"Search error: {e}"))
+
+# Entry caches are cleared by the change feed instead of expiring
+@st.cache_data
+def get_categories():
+    """Distinct AI categories, for filter dropdowns."""
     try:
-        result = supabase.rpc(
-            "match_entries",
-            {
-                "query_embedding": query_embedding,
-                "match_threshold": 0.65,
-                "match_count": limit
-            }
-        ).execute()
-        return result.data
-    except Exception as e:
-        st.error(f"Search error: {e}")
+        return supabase.rpc("entry_categories", {}).execute().data or []
+    except Exception:
+        # Before the entry_categories migration: page through every row
+        rows = pipeline.fetch_all_entries("category:ai_analysis->>category")
+        return sorted({row["category"] for row in rows if row.get("category")})
+
+@st.cache_data(ttl=300)
+def get_clusters():
+    """Precomputed topic clusters, largest first."""
+    return supabase.table("topic_clusters").select("cluster_id, label, size").gt("size", 0).order("size", desc=True).execute().data
+
+@st.cache_data
+def get_browse_entries(show_archived, cluster_id=None):
+    """Latest entries for the Browse page, optionally one topic cluster."""
+    query = supabase.table("entries").select("*")
+    if not show_archived:
+        query = query.eq("archived", False)
+    if cluster_id is not None:
+        members = supabase.table("entry_clusters").select("entry_id").eq(
+            "cluster_id", cluster_id
+        ).order("similarity", desc=True).limit(200).execute().data
+        query = query.in_("id", [m["entry_id"] for m in members])
+    return query.order("created_at", desc=True).limit(500).execute().data
+
+@st.cache_data
+def get_facet_entries(kind, variants, include_archived=False):
+    """Entries with a given category, topic or entity - a plain filter, no embedding.
+
+    variants are the spellings of the term (see SuggestIndex), matched exactly.
+    """
+    entries = {}
+    for text in variants:
+        query = supabase.table("entries").select("id, content, ai_analysis, created_at, archived")
+        if kind == "category":
+            query = query.filter("ai_analysis->>category", "eq", text)
+        else:
+            field = {"topic": "topics", "entity": "entities"}[kind]
+            query = query.filter(f"ai_analysis->{field}", "cs", json.dumps([text]))
+        if not include_archived:
+            query = query.eq("archived", False)
+        for entry in query.order("created_at", desc=True).limit(100).execute().data:
+            entries[entry["id"]] = entry
+    return sorted(entries.values(), key=lambda e: e["created_at"], reverse=True)[:100]
+
+def invalidate_entry_caches(events):
+    get_categories.clear()
+    get_browse_entries.clear()
+    get_facet_entries.clear()
+
+@st.cache_resource
+def subscribe_entry_caches():
+    """Register the cache invalidation once per process."""
+    return pipeline.changes.subscribe(invalidate_entry_caches)
+
+subscribe_entry_caches()
+
+@st.cache_resource
+def start_graph_refresher():
+    """Refresh related entries and clusters in the background as entries change, once per process.
+
+    Set auto_refresh = false under [graph] on all but one app process.
+    """
+    builder = GraphBuilder(supabase, dict(st.secrets.get("graph", {})))
+    if not builder.settings["auto_refresh"]:
+        return None
+    return GraphRefresher(builder, pipeline.changes, on_refresh=lambda count: get_clusters.clear())
+
+start_graph_refresher()
+
+def get_related_entries(entry_id):
+    """Precomputed nearest neighbours of an entry, best first."""
+    rows = supabase.table("entry_neighbors").select("neighbor_ids, similarities").eq("entry_id", entry_id).execute().data
+    if not rows or not rows[0]["neighbor_ids"]:
         return []
+    similarities = dict(zip(rows[0]["neighbor_ids"], rows[0]["similarities"]))
+    related = supabase.table("entries").select("id, content, ai_analysis, created_at").in_("id", list(similarities)).execute().data
+    for entry in related:
+        entry["similarity"] = similarities[entry["id"]]
+    return sorted(related, key=lambda e: -e["similarity"])
 
 # Main App
 st.markdown("""
@@ -505,9 +537,8 @@ if page == "➕ Add":
                         "content": description
                     })
             elif att['type'] == 'csv':
-                att['file'].seek(0)
-                df = pd.read_csv(att['file'])
-                csv_summary = analyze_csv(df)
+                with st.spinner(f"Reading {att['name']}..."):
+                    csv_summary = summarize_csv(att['file'], CSV_SETTINGS).to_text()
                 file_contents.append({
                     "name": att['name'],
                     "type": "csv",
@@ -540,7 +571,7 @@ if page == "➕ Add":
                 file_contents.append({
                     "name": att['name'],
                     "type": "pdf",
-                    "content": pdf_text[:5000]
+                    "content": truncate_tokens(pdf_text, MAX_CONTENT_TOKENS)
                 })
             else:
                 att['file'].seek(0)
@@ -559,9 +590,10 @@ if page == "➕ Add":
         
         if full_content.strip():
             with st.spinner("🤖 AI is analyzing..."):
-                ai_analysis = analyze_content(full_content, f"{len(file_contents)} file(s)" if file_contents else None)
-            
-            success, message = save_entry(full_content, ai_analysis, file_type, file_name)
+                success, message, ai_analysis = ingest_entry(
+                    full_content, file_type, file_name,
+                    f"{len(file_contents)} file(s)" if file_contents else None
+                )
             
             if success:
                 st.success(message)
@@ -592,11 +624,75 @@ if page == "➕ Add":
 elif page == "🔍 Search":
     st.header("Search Knowledge")
     
-    query = st.text_input("Ask anything...", placeholder="e.g., What feedback did we get about login?")
+    # Known topics, entities and categories from the in-memory prefix index
+    suggestion_icons = {"category": "📁", "topic": "🏷️", "entity": "👤"}
+    try:
+        suggestions = {f"{s['kind']}:{s['text']}": s for s in pipeline.suggest("", limit=1000)}
+    except Exception:
+        suggestions = {}
+    
+    def jump_to(key):
+        st.session_state.search_jump = key
+        st.session_state.search_query = ""
+    
+    query = st.text_input("Ask anything...", placeholder="e.g., What feedback did we get about login?", key="search_query")
+    jump_options = list(suggestions)
+    if st.session_state.get("search_jump") and st.session_state.search_jump not in suggestions:
+        jump_options.append(st.session_state.search_jump)
+    jump = st.selectbox(
+        "...eller hoppa direkt till ämne, entitet eller kategori",
+        jump_options, index=None, key="search_jump", placeholder="Börja skriva...",
+        format_func=lambda k: f"{suggestion_icons[suggestions[k]['kind']]} {suggestions[k]['text']} ({suggestions[k]['count']})"
+        if k in suggestions else k.split(":", 1)[1],
+    )
+    if query and not jump:
+        matches = pipeline.suggest(query, limit=5) if suggestions else []
+        if matches:
+            chip_cols = st.columns(len(matches))
+            for col, match in zip(chip_cols, matches):
+                key = f"{match['kind']}:{match['text']}"
+                col.button(f"{suggestion_icons[match['kind']]} {match['text']}", key=f"suggest_{key}",
+                           on_click=jump_to, args=(key,), use_container_width=True)
+    
+    with st.expander("🔎 Filter"):
+        fcol1, fcol2, fcol3 = st.columns(3)
+        with fcol1:
+            search_category = st.selectbox("Kategori", ["Alla"] + get_categories(), key="search_category")
+            search_archived = st.checkbox("Visa arkiverade", value=False, key="search_archived")
+        with fcol2:
+            search_file_type = st.selectbox("Filtyp", ["Alla"] + FILE_TYPES, key="search_file_type")
+            search_mine = st.checkbox("Bara mina poster", value=False, key="search_mine")
+        with fcol3:
+            search_dates = st.date_input("Datum", value=(), key="search_dates")
     
-    if query:
+    search_filters = {
+        "include_archived": search_archived,
+        "category": None if search_category == "Alla" else search_category,
+        "file_type": None if search_file_type == "Alla" else search_file_type,
+        "user_id": st.session_state.user.user.id if search_mine else None,
+    }
+    if len(search_dates) >= 1:
+        search_filters["created_after"] = search_dates[0].isoformat()
+    if len(search_dates) == 2:
+        search_filters["created_before"] = (search_dates[1] + timedelta(days=1)).isoformat()
+    
+    if jump:
+        jump_kind, jump_text = jump.split(":", 1)
+        jump_variants = tuple(suggestions[jump]["variants"]) if jump in suggestions else (jump_text,)
+        facet_entries = get_facet_entries(jump_kind, jump_variants, search_archived)
+        st.success(f"{len(facet_entries)} poster med {suggestion_icons[jump_kind]} {jump_text}")
+        for entry in facet_entries:
+            ai = entry.get('ai_analysis') or {}
+            st.write(f"**{ai.get('category', 'Entry')}** · {entry['created_at'][:10]}")
+            st.write(ai.get('summary', entry['content'][:200]))
+            if ai.get('topics'):
+                st.caption(f"🏷️ {', '.join(ai['topics'][:5])}")
+            with st.expander("📄 Visa fullständigt innehåll"):
+                st.write(entry['content'])
+            st.divider()
+    elif query:
         with st.spinner("Searching..."):
-            results = search_entries(query)
+            results = search_entries(query, filters=search_filters)
         
         if results:
             st.success(f"Hittade {len(results)} resultat")
@@ -626,8 +722,7 @@ Här är de {len(results)} matchande posterna (sammanfattningar):
 Skriv en kort, användbar sammanfattning (2-3 meningar) som svarar på frågan baserat på dessa resultat. 
 Svara på svenska. Var konkret och nämn specifika detaljer eller mönster du ser."""
                     
-                    response = model.generate_content(summary_prompt)
-                    ai_summary = response.text
+                    ai_summary = pipeline.summarize_results(summary_prompt, summary_data[:10])
                     
                     st.info(f"💡 **Sammanfattning:** {ai_summary}")
                 except Exception as e:
@@ -689,11 +784,11 @@ Svara på svenska. Var konkret och nämn specifika detaljer eller mönster du se
                     with action_col:
                         if result.get('archived'):
                             if st.button("♻️", key=f"search_unarchive_{result['id']}", help="Återställ"):
-                                supabase.table("entries").update({"archived": False}).eq("id", result['id']).execute()
+                                pipeline.set_archived(result['id'], False)
                                 st.rerun()
                         else:
                             if st.button("📦", key=f"search_archive_{result['id']}", help="Arkivera"):
-                                supabase.table("entries").update({"archived": True}).eq("id", result['id']).execute()
+                                pipeline.set_archived(result['id'], True)
                                 st.rerun()
                     
                     st.divider()
@@ -712,22 +807,21 @@ elif page == "📊 Browse":
     filter_col1, filter_col2, filter_col3 = st.columns(3)
     with filter_col1:
         show_archived = st.checkbox("Visa arkiverade", value=False)
+        try:
+            clusters = get_clusters()
+        except Exception:
+            clusters = []
+        cluster_labels = {f"{c['label']} ({c['size']})": c['cluster_id'] for c in clusters}
+        selected_cluster = st.selectbox("Ämneskluster", ["Alla"] + list(cluster_labels), key="browse_cluster")
     
     try:
-        # First get total count
-        count_response = supabase.table("entries").select("id", count="exact").execute()
-        total_count = count_response.count if hasattr(count_response, 'count') else len(count_response.data)
-        
-        if show_archived:
-            response = supabase.table("entries").select("*").order("created_at", desc=True).limit(500).execute()
-        else:
-            response = supabase.table("entries").select("*").eq("archived", False).order("created_at", desc=True).limit(500).execute()
+        entries = get_browse_entries(show_archived, cluster_labels.get(selected_cluster))
         
-        if response.data:
+        if entries:
             # Collect categories from entries with valid analysis
             categories = set()
             valid_count = 0
-            for entry in response.data:
+            for entry in entries:
                 ai = entry.get('ai_analysis') or {}
                 if ai.get('category') and 'error' not in ai:
                     categories.add(ai['category'])
@@ -742,15 +836,15 @@ elif page == "📊 Browse":
                     key="browse_category_filter"
                 )
             with filter_col3:
-                st.metric("Totalt poster", len(response.data))
-                if valid_count < len(response.data):
-                    st.caption(f"⚠️ {len(response.data) - valid_count} poster saknar AI-analys")
+                st.metric("Totalt poster", len(entries))
+                if valid_count < len(entries):
+                    st.caption(f"⚠️ {len(entries) - valid_count} poster saknar AI-analys")
             
             # Count filtered entries
-            filtered_entries = [e for e in response.data if filter_cat == "Alla" or (e.get('ai_analysis') or {}).get('category') == filter_cat]
+            filtered_entries = [e for e in entries if filter_cat == "Alla" or (e.get('ai_analysis') or {}).get('category') == filter_cat]
             
             if filter_cat != "Alla":
-                st.info(f"Visar {len(filtered_entries)} av {len(response.data)} poster i kategori '{filter_cat}'")
+                st.info(f"Visar {len(filtered_entries)} av {len(entries)} poster i kategori '{filter_cat}'")
             
             for entry in filtered_entries:
                 ai = entry.get('ai_analysis') or {}
@@ -762,6 +856,14 @@ elif page == "📊 Browse":
                         st.write(ai.get('summary', entry['content'][:200]))
                         if ai.get('topics'):
                             st.caption(f"🏷️ {', '.join(ai['topics'][:5])}")
+                        if st.session_state.get("related_for") == entry['id']:
+                            related = get_related_entries(entry['id'])
+                            if related:
+                                for rel in related:
+                                    rel_ai = rel.get('ai_analysis') or {}
+                                    st.caption(f"🔗 {rel['similarity'] * 100:.0f}% · {rel_ai.get('summary', rel['content'][:120])}")
+                            else:
+                                st.caption("Inga relaterade poster beräknade ännu.")
                     with entry_col2:
                         st.caption(entry['created_at'][:10])
                         if entry.get('file_type'):
@@ -772,15 +874,19 @@ elif page == "📊 Browse":
                         # Archive/Unarchive button
                         if entry.get('archived'):
                             if st.button("♻️", key=f"unarchive_{entry['id']}", help="Återställ"):
-                                supabase.table("entries").update({"archived": False}).eq("id", entry['id']).execute()
+                                pipeline.set_archived(entry['id'], False)
                                 st.rerun()
                         else:
                             if st.button("📦", key=f"archive_{entry['id']}", help="Arkivera"):
-                                supabase.table("entries").update({"archived": True}).eq("id", entry['id']).execute()
+                                pipeline.set_archived(entry['id'], True)
                                 st.rerun()
+                        # Related entries (precomputed)
+                        if st.button("🔗", key=f"related_{entry['id']}", help="Visa relaterade"):
+                            st.session_state.related_for = None if st.session_state.get("related_for") == entry['id'] else entry['id']
+                            st.rerun()
                         # Delete button
                         if st.button("🗑️", key=f"delete_{entry['id']}", help="Ta bort permanent"):
-                            supabase.table("entries").delete().eq("id", entry['id']).execute()
+                            pipeline.delete_entry(entry['id'])
                             st.rerun()
                     st.divider()
         else:
@@ -793,7 +899,14 @@ elif page == "📊 Browse":
 elif page == "🔧 Admin":
     st.header("Admin Tools")
     
-    st.info(f"🔧 Using model: **{MODEL_NAME}**")
+    st.info(f"🔧 Using models: **{router.model_name('small')}** (short inputs) → **{MODEL_NAME}** (long inputs, escalations)")
+    
+    # Per-route latency and cost
+    with st.expander("📈 Model routing stats"):
+        st.dataframe(pd.DataFrame(router.stats()), use_container_width=True, hide_index=True)
+        guards = [g.stats() for g in router.guards.values()] + [embed_guard.stats()]
+        st.dataframe(pd.DataFrame(guards), use_container_width=True, hide_index=True)
+        st.dataframe(pd.DataFrame([pipeline.changes.stats()]), use_container_width=True, hide_index=True)
     
     # List available models
     if st.button("Show available Gemini models"):
@@ -821,10 +934,18 @@ elif page == "🔧 Admin":
         
         if response.data:
             error_entries = []
+            truncated_entries = []
             for entry in response.data:
                 ai = entry.get('ai_analysis') or {}
-                if ai.get('error') or not ai.get('category'):
+                # Failed sections can succeed on a retry; skipped ones need a larger max_sections
+                if ai.get('error') or not ai.get('category') or ai.get('_sections_failed'):
                     error_entries.append(entry)
+                elif ai.get('_sections_skipped'):
+                    truncated_entries.append(entry)
+            
+            if truncated_entries:
+                st.caption(f"{len(truncated_entries)} entries were only partly analyzed: longer than "
+                           f"max_sections × section_tokens under [analysis]")
             
             if error_entries:
                 st.warning(f"Found {len(error_entries)} entries with missing/failed AI analysis")
@@ -841,9 +962,7 @@ elif page == "🔧 Admin":
                             
                             # Only update if successful (no error)
                             if 'error' not in new_analysis:
-                                supabase.table("entries").update({
-                                    "ai_analysis": new_analysis
-                                }).eq("id", entry['id']).execute()
+                                pipeline.update_analysis(entry['id'], new_analysis)
                                 st.caption(f"✅ Entry {i+1}: {new_analysis.get('category', 'OK')}")
                             else:
                                 st.caption(f"❌ Entry {i+1}: {new_analysis.get('error', '')[:100]}")
@@ -857,15 +976,16 @@ elif page == "🔧 Admin":
                 for entry in error_entries:
                     ai = entry.get('ai_analysis') or {}
                     with st.expander(f"❌ {entry['content'][:50]}..."):
-                        st.write(f"**Error:** {ai.get('error', 'No category')}")
+                        error = ai.get('error') or 'No category'
+                        if ai.get('_sections_failed'):
+                            error = f"{ai['_sections_failed']} of {ai.get('_sections')} sections failed"
+                        st.write(f"**Error:** {error}")
                         st.write(f"**Content:** {entry['content'][:300]}...")
                         
                         if st.button("Re-analyze this one", key=f"reanalyze_{entry['id']}"):
                             with st.spinner("Analyzing..."):
                                 new_analysis = analyze_content(entry['content'])
-                                supabase.table("entries").update({
-                                    "ai_analysis": new_analysis
-                                }).eq("id", entry['id']).execute()
+                                pipeline.update_analysis(entry['id'], new_analysis)
                             st.success("Done!")
                             st.rerun()
             else:
@@ -894,7 +1014,9 @@ elif page == "🔧 Admin":
                             embedding = generate_embedding(entry['content'])
                             if embedding:
                                 supabase.table("entries").update({
-                                    "embedding": embedding
+                                    "embedding": embedding,
+                                    "embedding_model": EMBEDDING.model,
+                                    "embedding_version": EMBEDDING.version
                                 }).eq("id", entry['id']).execute()
                                 st.write(f"✅ Entry {i+1}: Embedding generated")
                             else:
@@ -906,6 +1028,61 @@ elif page == "🔧 Admin":
     except Exception as e:
         st.error(f"Error: {e}")
     
+    # Related-entries graph and topic clusters
+    st.subheader("Related entries & clusters")
+    st.caption("Updated automatically shortly after entries change ([graph] auto_refresh). "
+               "Also available as a batch job: python entry_graph.py --incremental / --full")
+    graph_col1, graph_col2 = st.columns(2)
+    with graph_col1:
+        update_graph = st.button("🔄 Update graph (changed entries)")
+    with graph_col2:
+        rebuild_graph = st.button("🧮 Rebuild graph and clusters")
+    if update_graph or rebuild_graph:
+        builder = GraphBuilder(supabase, dict(st.secrets.get("graph", {})), log=st.write)
+        try:
+            with st.spinner("Computing neighbours and clusters..."):
+                count = builder.full_refresh() if rebuild_graph else builder.incremental_refresh()
+            get_clusters.clear()
+            st.success(f"✅ Processed {count} entries")
+        except Exception as e:
+            st.error(f"Error: {e}")
+    
+    # Embedding migration (when [embeddings] next_model is set)
+    st.subheader("Embedding migration")
+    st.caption(f"Current: `{EMBEDDING.tag}`" + (f" → next: `{NEXT_EMBEDDING.tag}` (search reads: {EMBEDDINGS['read']})" if NEXT_EMBEDDING else ""))
+    
+    if NEXT_EMBEDDING is not None:
+        try:
+            re_embedder = init_re_embedder()
+            status = re_embedder.progress()
+            st.progress(status["migrated"] / status["total"] if status["total"] else 1.0)
+            st.write(f"**{status['migrated']}/{status['total']}** migrated, {status['failed']} failed"
+                     + (" - running in background" if status["running"] else ""))
+            if status["last_error"]:
+                st.caption(f"Last error: {status['last_error'][:200]}")
+            
+            mig_col1, mig_col2, mig_col3 = st.columns(3)
+            with mig_col1:
+                if not status["running"] and st.button("▶️ Start re-embedding", type="primary"):
+                    re_embedder.start()
+                    st.rerun()
+            with mig_col2:
+                if status["running"] and st.button("⏸️ Pause"):
+                    re_embedder.stop()
+                    st.rerun()
+            with mig_col3:
+                if st.button("📏 Measure recall vs old index"):
+                    with st.spinner("Comparing neighbours..."):
+                        recall = re_embedder.recall_against_old()
+                    if recall is None:
+                        st.info("No migrated entries to compare yet.")
+                    else:
+                        st.metric("Recall@10 vs old index", f"{recall:.0%}")
+            if status["done"]:
+                st.success("✅ Backfill complete. Set read = \"next\", then promote (see supabase/migrations).")
+        except Exception as e:
+            st.error(f"Error: {e}")
+    
     # Excel bulk import
     st.subheader("📊 Bulk import from Excel")
     st.write("Import Excel-filer där varje rad blir en separat post")
@@ -953,31 +1130,12 @@ elif page == "🔧 Admin":
                             if i > 0:
                                 time.sleep(5)
                             
-                            # Analyze with AI
-                            ai_analysis = analyze_content(full_content)
-                            
-                            # Wait before embedding
-                            time.sleep(2)
-                            
-                            # Generate embedding
-                            embedding = generate_embedding(full_content)
-                            
-                            # Save to database
-                            data = {
-                                "user_id": st.session_state.user.user.id,
-                                "content": full_content,
-                                "ai_analysis": ai_analysis,
-                                "file_type": "xlsx",
-                                "file_name": excel_file.name,
-                                "embedding": embedding,
-                                "created_at": datetime.utcnow().isoformat()
-                            }
-                            
-                            try:
-                                supabase.table("entries").insert(data).execute()
+                            # Dedupe, analyze, embed and save
+                            success, message, _ = ingest_entry(full_content, "xlsx", excel_file.name)
+                            if success:
                                 success_count += 1
-                            except Exception as e:
-                                st.error(f"Rad {i+1} fel: {e}")
+                            else:
+                                st.error(f"Rad {i+1} fel: {message}")
                         
                         progress.progress((i + 1) / len(df))
                     
@@ -987,6 +1145,55 @@ elif page == "🔧 Admin":
                 st.error("Kunde inte läsa Excel-filen. Installera openpyxl: pip install openpyxl")
         except Exception as e:
             st.error(f"Fel vid läsning: {e}")
+    
+    # CSV bulk import, read in chunks so large exports fit in memory
+    st.subheader("📊 Bulk import from CSV")
+    st.write("Import CSV-filer där varje rad blir en separat post")
+    
+    csv_file = st.file_uploader("Välj CSV-fil", type=["csv"], key="csv_import")
+    
+    if csv_file:
+        try:
+            # Summarize once per uploaded file, not on every rerun
+            if st.session_state.get("csv_import_summary", (None,))[0] != csv_file.file_id:
+                with st.spinner("Läser filen..."):
+                    st.session_state.csv_import_summary = (csv_file.file_id, summarize_csv(csv_file, CSV_SETTINGS))
+            summary = st.session_state.csv_import_summary[1]
+            st.write(f"**{summary.rows} rader, {len(summary.columns)} kolumner**")
+            csv_file.seek(0)
+            st.dataframe(pd.read_csv(csv_file, nrows=10))
+            with st.expander("Kolumnstatistik"):
+                st.text(summary.to_text())
+            
+            content_col = st.selectbox("Vilken kolumn innehåller huvudtexten?", summary.columns, key="csv_content_col")
+            other_cols = [c for c in summary.columns if c != content_col]
+            include_cols = st.multiselect("Inkludera extra kolumner i varje post?", other_cols, key="csv_include_cols")
+            start_row = st.number_input("Börja på rad (för att återuppta en avbruten import)", min_value=1,
+                                        max_value=max(summary.rows, 1), value=1, key="csv_start_row")
+            
+            remaining = max(summary.rows - start_row + 1, 0)
+            if st.button(f"📥 Importera {remaining} rader som separata poster", type="primary", key="csv_import_start"):
+                progress = st.progress(0)
+                status = st.empty()
+                # Workers have no Streamlit session, so bind the user here
+                user_id = st.session_state.user.user.id
+                
+                def show_progress(report):
+                    progress.progress(min(report.rows / remaining, 1.0) if remaining else 1.0)
+                    status.write(f"{report.rows} rader: {report.saved} sparade, {report.failed} fel, "
+                                 f"{report.skipped} tomma (nästa rad {report.next_row})")
+                
+                report = import_csv(
+                    lambda content: pipeline.ingest_entry(user_id, content, "csv", csv_file.name),
+                    csv_file, content_col, include_cols, CSV_SETTINGS,
+                    start_row=start_row, on_progress=show_progress,
+                )
+                for row, message in report.errors:
+                    st.error(f"Rad {row} fel: {message}")
+                st.success(f"✅ Importerade {report.saved} poster!")
+                st.balloons()
+        except Exception as e:
+            st.error(f"Fel vid läsning: {e}")
 
 st.markdown("---")
 st.caption("KnowledgeHub • AI-powered knowledge capture")
@@ -0,0 +1,196 @@
+"""Entry change events for in-process caches and indexes.
+
+A trigger records every insert, delete and relevant update of entries in
+the entry_changes outbox table. One OutboxPoller per process reads new
+rows and publishes them to subscribers, so caches stay correct across
+sessions and processes without TTLs:
+
+    feed = create_change_feed(supabase, st.secrets.get("changefeed", {}))
+    feed.subscribe(lambda events: get_categories.clear())
+    feed.start()
+
+Writes made through the pipeline are also published right away with
+notify(), so the writing process does not wait for the next poll. The
+trigger stamps the written row with its outbox id (change_seq), so that
+echo is dropped by id when the poller reads it. LocalChangeFeed has the
+same interface without the database, for tools and tests that only see
+their own writes.
+"""
+import threading
+from dataclasses import dataclass
+
+DEFAULT_CHANGEFEED = {
+    "source": "outbox",      # "outbox" (entry_changes table) or "local" (this process only)
+    "poll_interval_s": 2.0,
+    "batch_size": 500,
+    # Outbox ids can commit out of order; re-read this many ids behind the cursor
+    "lookback": 100,
+}
+
+OPS = ("insert", "update", "delete")
+
+
+@dataclass
+class ChangeEvent:
+    entry_id: str
+    op: str
+    seq: int = None
+    row: dict = None  # The written row, when the change was made by this process
+
+
+class LocalChangeFeed:
+    """In-memory change feed: publishes the writes made by this process."""
+
+    source = "local"
+
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, callback, ops=OPS):
+        """Call callback(events) for each batch of events with an op in ops.
+
+        Callbacks run on the publishing thread and must be idempotent, since
+        the same change can be delivered more than once. Returns a function
+        that unsubscribes.
+        """
+        subscriber = (callback, frozenset(ops))
+        with self._lock:
+            self._subscribers.append(subscriber)
+
+        def unsubscribe():
+            with self._lock:
+                if subscriber in self._subscribers:
+                    self._subscribers.remove(subscriber)
+        return unsubscribe
+
+    def publish(self, events):
+        if not events:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self.published += len(events)
+        for callback, ops in subscribers:
+            batch = [e for e in events if e.op in ops]
+            if not batch:
+                continue
+            try:
+                callback(batch)
+            except Exception as e:
+                print(f"Change subscriber error: {e}")
+
+    def notify(self, entry_id, op, row=None):
+        """Publish a write made by this process; row is the written row, if returned."""
+        seq = (row or {}).get("change_seq")
+        self.publish([ChangeEvent(str(entry_id), op, seq=seq, row=row)])
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+    def stats(self):
+        return {"source": self.source, "published": self.published, "subscribers": len(self._subscribers)}
+
+
+class OutboxPoller(LocalChangeFeed):
+    """Change feed that also polls the entry_changes outbox for writes from other processes."""
+
+    source = "outbox"
+
+    def __init__(self, supabase, settings=None):
+        super().__init__()
+        self.supabase = supabase
+        self.settings = {**DEFAULT_CHANGEFEED, **(settings or {})}
+        self.cursor = None
+        self.last_error = None
+        self.echoes_dropped = 0
+        self._seen = set()
+        self._echoes = set()  # change_seq of rows written by this process, not yet polled
+        self._stop = threading.Event()
+        self._thread = None
+
+    def notify(self, entry_id, op, row=None):
+        seq = (row or {}).get("change_seq")
+        # A write that changed no tracked column returns an already polled seq
+        if seq is not None and (self.cursor is None or seq > self.cursor - self.settings["lookback"]):
+            with self._lock:
+                self._echoes.add(seq)
+        super().notify(entry_id, op, row)
+
+    def _recent_seqs(self):
+        rows = (self.supabase.table("entry_changes").select("id").order("id", desc=True)
+                .limit(self.settings["lookback"]).execute().data)
+        return [r["id"] for r in rows]
+
+    def poll_once(self):
+        """Publish outbox rows past the cursor. Returns the number of new rows.
+
+        The first call only positions the cursor at the end of the outbox:
+        subscribers start from fresh caches, so history is not replayed.
+        """
+        if self.cursor is None:
+            seqs = self._recent_seqs()
+            self.cursor = max(seqs, default=0)
+            self._seen = set(seqs)
+            return 0
+        lookback = self.settings["lookback"]
+        rows = (self.supabase.table("entry_changes").select("id, entry_id, op")
+                .gt("id", self.cursor - lookback).order("id")
+                .limit(self.settings["batch_size"]).execute().data)
+        rows = [r for r in rows if r["id"] not in self._seen]
+        if not rows:
+            return 0
+        self._seen.update(r["id"] for r in rows)
+        self.cursor = max(self.cursor, rows[-1]["id"])
+        self._seen = {seq for seq in self._seen if seq > self.cursor - lookback}
+
+        events = [ChangeEvent(str(r["entry_id"]), r["op"], seq=r["id"]) for r in rows]
+        with self._lock:
+            fresh = [e for e in events if e.seq not in self._echoes]
+            self._echoes -= {e.seq for e in events}
+            self._echoes = {seq for seq in self._echoes if seq > self.cursor - lookback}
+        self.echoes_dropped += len(events) - len(fresh)
+        self.publish(fresh)
+        return len(rows)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll_once()
+                self.last_error = None
+            except Exception as e:
+                if str(e) != self.last_error:
+                    print(f"Change feed error: {e}")
+                self.last_error = str(e)
+            self._stop.wait(self.settings["poll_interval_s"])
+
+    def start(self):
+        """Poll in a background thread until stop(). Safe to call more than once."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="entry-changes", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "cursor": self.cursor,
+            "echoes_dropped": self.echoes_dropped,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "last_error": self.last_error,
+        }
+
+
+def create_change_feed(supabase, settings=None):
+    """Change feed configured by the [changefeed] secrets section."""
+    settings = {**DEFAULT_CHANGEFEED, **(settings or {})}
+    if settings["source"] == "local":
+        return LocalChangeFeed()
+    return OutboxPoller(supabase, settings)
@@ -0,0 +1,300 @@
+"""Streaming CSV summaries and bulk import, for files too large to load at once.
+
+    python csv_import.py export.csv                                  # print the summary
+    python csv_import.py export.csv --content-column body --user-id <uuid> \\
+        --include status,created --start-row 120000                  # import rows as entries
+
+The file is read chunk_rows rows at a time, so memory depends on the chunk
+size and not on the file: CsvSummary keeps row and column counts, numeric
+ranges, the most common values and a few sample rows, and import_csv turns
+each row into an entry through the pipeline with at most `parallel` rows in
+flight. Rows already imported are caught by dedupe, so an interrupted import
+can be restarted from its report's next_row.
+"""
+import argparse
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+DEFAULT_CSV = {
+    # Rows per chunk read from the file (memory ~ chunk_rows * row size)
+    "chunk_rows": 50000,
+    # Import: rows ingested at once, and overall throttle (0 = unthrottled)
+    "parallel": 4,
+    "rows_per_minute": 30,
+    "sample_rows": 3,
+    "top_values": 3,
+}
+
+# Distinct values tracked per column before the rarest are dropped
+MAX_TRACKED = 10000
+# Errors kept in an ImportReport
+MAX_ERRORS = 50
+
+
+def read_chunks(file, chunk_rows=None, **kwargs):
+    """DataFrames of up to chunk_rows rows from a path or file object."""
+    if hasattr(file, "seek"):
+        file.seek(0)
+    with pd.read_csv(file, chunksize=chunk_rows or DEFAULT_CSV["chunk_rows"],
+                     encoding_errors="replace", **kwargs) as reader:
+        yield from reader
+
+
+def _number(value):
+    return f"{value:,.4g}" if abs(value) < 1e15 else f"{value:.4g}"
+
+
+class ColumnStats:
+    """Running statistics of one column. Top values are approximate past MAX_TRACKED distinct values."""
+
+    def __init__(self):
+        self.filled = 0
+        self.text = 0          # Non-empty values that are not numbers
+        self.count = 0         # Numeric values, with their running mean and M2 (Chan et al.)
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.values = Counter()
+        self.unique = False    # Stopped counting values: nearly all distinct
+
+    def update(self, series):
+        values = series.dropna()
+        self.filled += len(values)
+        if not len(values):
+            return
+        if not self.text and not pd.api.types.is_bool_dtype(values):
+            numbers = pd.to_numeric(values, errors="coerce").dropna().astype(float)
+            self.text += len(values) - len(numbers)
+            if len(numbers):
+                self._add_numbers(numbers)
+        else:
+            self.text += len(values)
+        if self.text and not self.unique:
+            counts = values.astype(str).value_counts()
+            if len(values) >= 100 and len(counts) > 0.9 * len(values):
+                self.unique = True
+                self.values.clear()
+                return
+            self.values.update(counts.to_dict())
+            if len(self.values) > MAX_TRACKED:
+                self.values = Counter(dict(self.values.most_common(MAX_TRACKED // 2)))
+
+    def _add_numbers(self, numbers):
+        n, mean = len(numbers), numbers.mean()
+        m2 = ((numbers - mean) ** 2).sum()
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.count * n / total
+        self.count = total
+        low, high = numbers.min(), numbers.max()
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    @property
+    def numeric(self):
+        return self.count > 0 and not self.text
+
+    @property
+    def std(self):
+        return (self.m2 / (self.count - 1)) ** 0.5 if self.count > 1 else 0.0
+
+    def describe(self, rows, top_values=3):
+        """One line for the summary text."""
+        if not self.filled:
+            return "empty"
+        if self.numeric:
+            text = (f"numbers {_number(self.min)} to {_number(self.max)}, "
+                    f"mean {_number(self.mean)}, std {_number(self.std)}")
+        elif self.unique:
+            text = "mostly unique values"
+        else:
+            top = ", ".join(f"{value[:40]} ({count:,})" for value, count in self.values.most_common(top_values))
+            text = f"top values: {top}"
+        if self.filled < rows:
+            text += f"; {rows - self.filled:,} empty"
+        return text
+
+
+class CsvSummary:
+    """Shape, per-column statistics and sample rows of a CSV, built chunk by chunk."""
+
+    def __init__(self, sample_rows=3, top_values=3):
+        self.sample_rows = sample_rows
+        self.top_values = top_values
+        self.rows = 0
+        self.columns = []
+        self.sample = None
+        self.stats = {}
+
+    def update(self, chunk):
+        if self.sample is None:
+            self.columns = chunk.columns.astype(str).tolist()
+            self.sample = chunk.head(self.sample_rows).copy()
+            self.stats = {col: ColumnStats() for col in chunk.columns}
+        self.rows += len(chunk)
+        for col, stats in self.stats.items():
+            stats.update(chunk[col])
+
+    def to_text(self):
+        """Same layout as analyze_csv in app.py, with a line of statistics per column."""
+        summary = f"Spreadsheet with {self.rows} rows and {len(self.columns)} columns.\n"
+        summary += f"Columns: {', '.join(self.columns)}\n"
+        if self.stats:
+            summary += "Column summary:\n"
+            summary += "".join(f"- {col}: {stats.describe(self.rows, self.top_values)}\n"
+                               for col, stats in self.stats.items())
+        sample = self.sample if self.sample is not None else pd.DataFrame()
+        summary += f"Sample data:\n{sample.to_string()}"
+        return summary
+
+
+def summarize_csv(file, settings=None):
+    """Read the whole file once and return its CsvSummary."""
+    settings = {**DEFAULT_CSV, **(settings or {})}
+    summary = CsvSummary(settings["sample_rows"], settings["top_values"])
+    for chunk in read_chunks(file, settings["chunk_rows"]):
+        summary.update(chunk)
+    return summary
+
+
+def row_content(row, content_col, include_cols=()):
+    """Entry text for one row, like the Excel import: the content column, then "column: value" lines."""
+    main = row.get(content_col)
+    if pd.isna(main) or not str(main).strip():
+        return None
+    extra = "\n".join(f"{col}: {row[col]}" for col in include_cols if pd.notna(row.get(col)))
+    return f"{main}\n\n{extra}" if extra else str(main)
+
+
+def iter_rows(file, content_col, include_cols=(), chunk_rows=None, start_row=1):
+    """(row number, entry text or None) for each data row, counting from 1."""
+    number = 0
+    usecols = [content_col, *[c for c in include_cols if c != content_col]]
+    for chunk in read_chunks(file, chunk_rows, usecols=usecols, dtype=str):
+        if number + len(chunk) < start_row:
+            number += len(chunk)
+            continue
+        for row in chunk.to_dict("records"):
+            number += 1
+            if number >= start_row:
+                yield number, row_content(row, content_col, include_cols)
+
+
+@dataclass
+class ImportReport:
+    rows: int = 0        # Rows finished (saved, failed or empty)
+    saved: int = 0
+    failed: int = 0
+    skipped: int = 0     # Empty content
+    next_row: int = 1    # Every row before this one is finished
+    errors: list = field(default_factory=list)  # (row, message), the first MAX_ERRORS
+
+
+def import_csv(ingest, file, content_col, include_cols=(), settings=None, start_row=1,
+               max_rows=None, on_progress=None, stop=None):
+    """Import each row as an entry with ingest(content) -> (success, message, ai_analysis).
+
+    ingest runs on worker threads; on_progress(report) and the returned
+    report are on the calling thread. Set the stop event to finish the rows
+    in flight and return early.
+    """
+    settings = {**DEFAULT_CSV, **(settings or {})}
+    parallel = max(1, int(settings["parallel"]))
+    interval = 60.0 / settings["rows_per_minute"] if settings["rows_per_minute"] else 0.0
+    report = ImportReport(next_row=start_row)
+    stop = stop or threading.Event()
+    pending = {}  # future -> row number
+    next_at = time.monotonic()
+
+    def finish(futures):
+        for future in futures:
+            row = pending.pop(future)
+            try:
+                success, message, _ = future.result()
+            except Exception as e:
+                success, message = False, f"Error: {e}"
+            report.rows += 1
+            if success:
+                report.saved += 1
+            else:
+                report.failed += 1
+                if len(report.errors) < MAX_ERRORS:
+                    report.errors.append((row, message))
+
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        rows = iter_rows(file, content_col, include_cols, settings["chunk_rows"], start_row)
+        for row, content in rows:
+            if stop.is_set() or (max_rows and row >= start_row + max_rows):
+                break
+            if content is None:
+                report.rows += 1
+                report.skipped += 1
+                continue
+            if len(pending) >= parallel:
+                finish(wait(pending, return_when=FIRST_COMPLETED).done)
+                report.next_row = min(pending.values(), default=row)
+                if on_progress:
+                    on_progress(report)
+            if interval:
+                time.sleep(max(0.0, next_at - time.monotonic()))
+                next_at = max(next_at, time.monotonic()) + interval
+            pending[pool.submit(ingest, content)] = row
+        rows.close()
+        finish(wait(pending).done)
+    report.next_row = start_row + report.rows
+    if on_progress:
+        on_progress(report)
+    return report
+
+
+def main():
+    from pipeline import Pipeline
+    from settings import load_secrets
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("file", help="CSV file")
+    parser.add_argument("--content-column", help="import rows: column with the entry text")
+    parser.add_argument("--include", default="", help="comma-separated columns added as 'column: value' lines")
+    parser.add_argument("--user-id", help="owner of the imported entries")
+    parser.add_argument("--start-row", type=int, default=1, help="first data row to import (resume)")
+    parser.add_argument("--max-rows", type=int, help="stop after this many rows")
+    parser.add_argument("--secrets", help="path to secrets.toml")
+    args = parser.parse_args()
+
+    secrets = load_secrets(args.secrets)
+    settings = dict(secrets.get("csv", {}))
+    if not args.content_column:
+        print(summarize_csv(args.file, settings).to_text())
+        return
+    if not args.user_id:
+        parser.error("--user-id is required to import rows")
+
+    pipeline = Pipeline.from_secrets(secrets)
+    file_name = args.file.rsplit("/", 1)[-1]
+    include = [c.strip() for c in args.include.split(",") if c.strip()]
+
+    def progress(report):
+        print(f"\r{report.rows} rows: {report.saved} saved, {report.failed} failed, "
+              f"{report.skipped} empty (next row {report.next_row})", end="", flush=True)
+
+    try:
+        report = import_csv(lambda content: pipeline.ingest_entry(args.user_id, content, "csv", file_name),
+                            args.file, args.content_column, include, settings,
+                            start_row=args.start_row, max_rows=args.max_rows, on_progress=progress)
+    except KeyboardInterrupt:
+        print("\nInterrupted - rows in flight may not be saved; resume with --start-row")
+        return
+    print()
+    for row, message in report.errors:
+        print(f"Row {row}: {message}")
+
+
+if __name__ == "__main__":
+    main()
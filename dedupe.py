@@ -0,0 +1,125 @@
+"""Near-duplicate detection at ingest: MinHash/LSH over shingles."""
+import hashlib
+import re
+import threading
+
+import numpy as np
+
+DEFAULT_DEDUPE = {
+    "enabled": True,
+    # What to do with a duplicate: "skip", "merge" (count it on the original) or
+    # "link" (save another row, which is searchable and grows the index)
+    "action": "merge",
+    # Estimated Jaccard similarity of word shingles
+    "lexical_threshold": 0.85,
+    # Cosine similarity of embeddings
+    "semantic_threshold": 0.97,
+    "shingle_size": 3,
+    "num_perm": 128,
+    "bands": 32,
+}
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_WORD_RE = re.compile(r"\w+")
+
+
+def shingles(text, size=3):
+    """Set of word n-grams of the normalized text."""
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _hash_shingles(items):
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "little") for s in items),
+        dtype=np.uint64, count=len(items),
+    )
+
+
+class MinHasher:
+    """MinHash signatures using universal hashing (a * x + b) mod p."""
+
+    def __init__(self, num_perm=128, seed=1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self._a = rng.integers(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingle_set):
+        if not shingle_set:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint32)
+        hashes = _hash_shingles(list(shingle_set))
+        # (num_shingles, num_perm) - values stay below 2**64 since a, x < 2**32
+        permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+def estimate_jaccard(sig_a, sig_b):
+    return float(np.mean(sig_a == sig_b))
+
+
+class LSHIndex:
+    """Banded LSH over MinHash signatures, updated incrementally."""
+
+    def __init__(self, settings=None):
+        self.settings = {**DEFAULT_DEDUPE, **(settings or {})}
+        self.hasher = MinHasher(self.settings["num_perm"])
+        self.rows = self.settings["num_perm"] // self.settings["bands"]
+        self._buckets = {}
+        self._signatures = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def _bands(self, sig):
+        for band in range(self.settings["bands"]):
+            yield band, sig[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def signature(self, text):
+        """MinHash signature of text, or None when it has no words to compare."""
+        shingle_set = shingles(text, self.settings["shingle_size"])
+        return self.hasher.signature(shingle_set) if shingle_set else None
+
+    def add(self, entry_id, text=None, signature=None):
+        sig = self.signature(text) if signature is None else signature
+        if sig is None:
+            # Empty or punctuation-only text would match every other such entry
+            self.remove(entry_id)
+            return
+        with self._lock:
+            self._signatures[entry_id] = sig
+            for key in self._bands(sig):
+                self._buckets.setdefault(key, set()).add(entry_id)
+
+    def remove(self, entry_id):
+        with self._lock:
+            sig = self._signatures.pop(entry_id, None)
+            if sig is None:
+                return
+            for key in self._bands(sig):
+                bucket = self._buckets.get(key)
+                if bucket:
+                    bucket.discard(entry_id)
+                    if not bucket:
+                        del self._buckets[key]
+
+    def query(self, text=None, signature=None, threshold=None):
+        """Entries whose estimated Jaccard is at least threshold, best first.
+
+        Returns a list of (entry_id, similarity).
+        """
+        sig = self.signature(text) if signature is None else signature
+        if sig is None:
+            return []
+        threshold = self.settings["lexical_threshold"] if threshold is None else threshold
+        with self._lock:
+            candidates = set()
+            for key in self._bands(sig):
+                candidates |= self._buckets.get(key, set())
+            scored = [(cid, estimate_jaccard(sig, self._signatures[cid])) for cid in candidates]
+        return sorted([(cid, sim) for cid, sim in scored if sim >= threshold],
+                      key=lambda pair: -pair[1])
@@ -0,0 +1,199 @@
+"""Versioned embeddings and the online re-embedder used to migrate models."""
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+import google.generativeai as genai
+
+from ranking import parse_embedding
+from tokens import truncate_tokens
+
+EMBED_MAX_TOKENS = 2000
+
+DEFAULT_EMBEDDINGS = {
+    "model": "models/gemini-embedding-001",
+    "version": 1,
+    "dimensions": None,
+    # Set next_model/next_version to start a migration
+    "next_model": None,
+    "next_version": None,
+    "next_dimensions": None,
+    # Which index search reads: "current", "both" (during migration) or "next"
+    "read": "both",
+    # Re-embedder throttle
+    "rate_per_minute": 60,
+    "batch_size": 20,
+}
+
+
+@dataclass(frozen=True)
+class EmbeddingSpec:
+    """Which model produced a vector, and how."""
+
+    model: str
+    version: int
+    dimensions: int = None
+
+    @property
+    def tag(self):
+        return f"{self.model}@v{self.version}"
+
+
+def load_specs(settings):
+    """Return (current spec, next spec or None) from [embeddings] settings."""
+    current = EmbeddingSpec(settings["model"], int(settings["version"]), settings.get("dimensions") or None)
+    if not settings.get("next_model"):
+        return current, None
+    upcoming = EmbeddingSpec(settings["next_model"], int(settings.get("next_version") or current.version + 1),
+                             settings.get("next_dimensions") or None)
+    return current, upcoming
+
+
+def embed_text(text, spec, task_type="retrieval_document", guard=None):
+    """Embed text with the given spec. Raises on failure."""
+    kwargs = {
+        "model": spec.model,
+        "content": truncate_tokens(text, EMBED_MAX_TOKENS),
+        "task_type": task_type,
+    }
+    if spec.dimensions:
+        kwargs["output_dimensionality"] = spec.dimensions
+    if guard is None:
+        return genai.embed_content(**kwargs)["embedding"]
+    kwargs["request_options"] = {"timeout": guard.settings["deadline_s"]}
+    return guard(genai.embed_content, **kwargs)["embedding"]
+
+
+class ReEmbedder:
+    """Throttled, resumable backfill of `embedding_next` for a new spec.
+
+    Progress (cursor, counts) is stored in the embedding_migrations table,
+    so a restarted process continues where the last one stopped. Search
+    keeps reading the current column until the backfill is done.
+    """
+
+    def __init__(self, supabase, spec, embed_fn, rate_per_minute=60, batch_size=20):
+        self.supabase = supabase
+        self.spec = spec
+        self.embed_fn = embed_fn
+        self.interval = 60.0 / rate_per_minute if rate_per_minute else 0.0
+        self.batch_size = batch_size
+        self.state = self._load_state()
+        self.last_error = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _load_state(self):
+        rows = self.supabase.table("embedding_migrations").select("*").eq("target", self.spec.tag).execute().data
+        if rows:
+            return rows[0]
+        return {"target": self.spec.tag, "cursor": None, "processed": 0, "failed": 0, "done": False}
+
+    def _save_state(self):
+        self.state["updated_at"] = datetime.utcnow().isoformat()
+        self.supabase.table("embedding_migrations").upsert(self.state, on_conflict="target").execute()
+
+    def run_batch(self):
+        """Re-embed one batch. Returns the number of rows handled."""
+        # Rows saved during the migration are dual-written and skipped here
+        query = (self.supabase.table("entries").select("id, content")
+                 .or_(f"embedding_next_version.is.null,embedding_next_version.neq.{self.spec.version}")
+                 .order("id").limit(self.batch_size))
+        if self.state["cursor"]:
+            query = query.gt("id", self.state["cursor"])
+        rows = query.execute().data
+        if not rows:
+            self.state["done"] = True
+            self._save_state()
+            return 0
+
+        for row in rows:
+            if self._stop.is_set():
+                break
+            started = time.monotonic()
+            try:
+                vector = self.embed_fn(row["content"] or "", self.spec)
+                self.supabase.table("entries").update({
+                    "embedding_next": vector,
+                    "embedding_next_model": self.spec.model,
+                    "embedding_next_version": self.spec.version,
+                }).eq("id", row["id"]).execute()
+                self.state["processed"] += 1
+            except Exception as e:
+                self.last_error = str(e)
+                self.state["failed"] += 1
+            self.state["cursor"] = row["id"]
+            # Throttle to stay inside the embedding quota
+            time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+        self._save_state()
+        return len(rows)
+
+    def progress(self):
+        """Counts for the Admin page: total, migrated, remaining."""
+        total = self.supabase.table("entries").select("id", count="exact").limit(1).execute().count or 0
+        migrated = (self.supabase.table("entries").select("id", count="exact")
+                    .eq("embedding_next_version", self.spec.version).limit(1).execute().count or 0)
+        return {
+            "target": self.spec.tag,
+            "total": total,
+            "migrated": migrated,
+            "remaining": max(0, total - migrated),
+            "failed": self.state["failed"],
+            "done": bool(self.state["done"]) and migrated >= total,
+            "running": self.running,
+            "last_error": self.last_error,
+        }
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Run in a background thread until done or stopped."""
+        if self.running:
+            return
+        self._stop.clear()
+        if self.state["done"]:
+            # New pass to pick up rows that failed or were skipped earlier
+            self.state["cursor"] = None
+        self.state["done"] = False
+
+        def loop():
+            while not self._stop.is_set() and self.run_batch():
+                pass
+
+        self._thread = threading.Thread(target=loop, name="re-embedder", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def recall_against_old(self, sample_size=20, k=10):
+        """Mean overlap of top-k neighbours in the old and new index.
+
+        Uses migrated entries as queries: each one's old vector searches
+        the current column, its new vector searches embedding_next.
+        """
+        rows = (self.supabase.table("entries").select("id, embedding, embedding_next")
+                .eq("embedding_next_version", self.spec.version)
+                .not_.is_("embedding", "null").limit(sample_size).execute().data)
+        recalls = []
+        for row in rows:
+            old = self._neighbours(row["embedding"], k, use_next=False)
+            new = self._neighbours(row["embedding_next"], k, use_next=True)
+            old.discard(row["id"])
+            new.discard(row["id"])
+            if old:
+                recalls.append(len(old & new) / len(old))
+        return sum(recalls) / len(recalls) if recalls else None
+
+    def _neighbours(self, vector, k, use_next):
+        result = self.supabase.rpc("match_entries_filtered", {
+            "query_embedding": parse_embedding(vector).tolist(),
+            "match_threshold": -1,
+            "match_count": k + 1,
+            "include_archived": True,
+            "use_next": use_next,
+        }).execute()
+        return {row["id"] for row in result.data}
@@ -0,0 +1,481 @@
+"""Precomputed related-entries graph and topic clusters.
+
+Run as a batch job:
+
+    python entry_graph.py --full          # rebuild neighbours and clusters
+    python entry_graph.py --incremental   # only entries added or changed since the last run
+
+The results go to entry_neighbors, entry_clusters and topic_clusters, so
+the app can show related entries and browse by cluster with plain selects.
+Incremental runs resume from the entry_changes outbox id of the last run;
+GraphRefresher runs one shortly after entries change.
+"""
+import argparse
+import json
+import threading
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+
+DEFAULT_GRAPH = {
+    "neighbors": 10,
+    # Rows and columns per matrix-multiply block (memory ~ rows * cols * 4 bytes)
+    "block_rows": 1024,
+    "block_cols": 8192,
+    # 0 = pick from corpus size
+    "clusters": 0,
+    "kmeans_iterations": 25,
+    # Entries less similar than this to their centroid are left unclustered
+    "noise_threshold": 0.55,
+    "min_similarity": 0.5,
+    # Refresh incrementally in the background this long after entries change (app only)
+    "auto_refresh": True,
+    "refresh_delay_s": 30,
+}
+
+UNCLUSTERED = -1
+_WRITE_BATCH = 500
+# Entry ids per in_() filter, to keep request URLs short
+_ID_BATCH = 200
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def _parse_embedding(value):
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def load_matrix(rows, dtype=np.float32):
+    """Stack the embeddings of rows into a normalized (n, d) matrix.
+
+    Returns (ids, matrix). Rows without an embedding are skipped; pgvector
+    strings are parsed straight into the preallocated array.
+    """
+    rows = [r for r in rows if r.get("embedding") is not None]
+    if not rows:
+        return [], np.zeros((0, 0), dtype=dtype)
+    matrix = np.empty((len(rows), len(_parse_embedding(rows[0]["embedding"]))), dtype=dtype)
+    for i, row in enumerate(rows):
+        matrix[i] = _parse_embedding(row["embedding"])
+    _normalize_in_place(matrix)
+    return [r["id"] for r in rows], matrix
+
+
+def _normalize_in_place(matrix, block_rows=8192):
+    for r0 in range(0, len(matrix), block_rows):
+        block = matrix[r0:r0 + block_rows]
+        norms = np.linalg.norm(block.astype(np.float32, copy=False), axis=1, keepdims=True)
+        block /= np.where(norms == 0, 1, norms).astype(matrix.dtype)
+
+
+def top_k_neighbors(matrix, k, queries=None, block_rows=1024, block_cols=8192, exclude_self=True):
+    """k nearest rows of `matrix` (cosine) for each query row, blocked in both axes.
+
+    `queries` defaults to `matrix` itself, excluding each row's own index.
+    Returns (indices, similarities), both (n_queries, k), best first.
+    """
+    self_join = queries is None
+    queries = matrix if self_join else queries
+    n, m = len(queries), len(matrix)
+    k = min(k, m - 1 if self_join and exclude_self else m)
+    indices = np.zeros((n, k), dtype=np.int64)
+    sims = np.zeros((n, k), dtype=np.float32)
+    if k <= 0:
+        return indices, sims
+
+    for r0 in range(0, n, block_rows):
+        block = np.asarray(queries[r0:r0 + block_rows], dtype=np.float32)
+        best_sim = np.full((len(block), k), -np.inf, dtype=np.float32)
+        best_idx = np.zeros((len(block), k), dtype=np.int64)
+        for c0 in range(0, m, block_cols):
+            cols = np.asarray(matrix[c0:c0 + block_cols], dtype=np.float32)
+            scores = block @ cols.T
+            if self_join and exclude_self:
+                # Mask the diagonal where row and column blocks overlap
+                rows_idx = np.arange(r0, r0 + len(block))
+                overlap = (rows_idx >= c0) & (rows_idx < c0 + len(cols))
+                scores[np.nonzero(overlap)[0], rows_idx[overlap] - c0] = -np.inf
+            cand_sim = np.concatenate([best_sim, scores], axis=1)
+            cand_idx = np.concatenate(
+                [best_idx, np.broadcast_to(np.arange(c0, c0 + len(cols)), scores.shape)], axis=1)
+            top = np.argpartition(-cand_sim, k - 1, axis=1)[:, :k]
+            best_sim = np.take_along_axis(cand_sim, top, axis=1)
+            best_idx = np.take_along_axis(cand_idx, top, axis=1)
+        order = np.argsort(-best_sim, axis=1)
+        sims[r0:r0 + len(block)] = np.take_along_axis(best_sim, order, axis=1)
+        indices[r0:r0 + len(block)] = np.take_along_axis(best_idx, order, axis=1)
+    return indices, sims
+
+
+def assign_to_centroids(matrix, centroids, block_rows=4096):
+    """Nearest centroid (cosine) per row. Returns (labels, similarities)."""
+    labels = np.empty(len(matrix), dtype=np.int64)
+    sims = np.empty(len(matrix), dtype=np.float32)
+    for r0 in range(0, len(matrix), block_rows):
+        scores = np.asarray(matrix[r0:r0 + block_rows], dtype=np.float32) @ centroids.T
+        labels[r0:r0 + len(scores)] = scores.argmax(axis=1)
+        sims[r0:r0 + len(scores)] = scores.max(axis=1)
+    return labels, sims
+
+
+def _kmeans_plus_plus(sample, n_clusters, rng):
+    centroids = [sample[rng.integers(len(sample))]]
+    closest = 1 - sample @ centroids[0]
+    for _ in range(1, n_clusters):
+        weights = np.clip(closest, 0, None) ** 2
+        total = weights.sum()
+        pick = rng.choice(len(sample), p=weights / total) if total > 0 else rng.integers(len(sample))
+        centroids.append(sample[pick])
+        closest = np.minimum(closest, 1 - sample @ sample[pick])
+    return np.stack(centroids).astype(np.float32)
+
+
+def spherical_kmeans(matrix, n_clusters, iterations=25, block_rows=4096, seed=0, sample_size=10000):
+    """Cosine k-means with k-means++ seeding on a sample and blocked assignment.
+
+    Returns (labels, centroid similarities, centroids).
+    """
+    rng = np.random.default_rng(seed)
+    n = len(matrix)
+    n_clusters = max(1, min(n_clusters, n))
+    sample_idx = rng.choice(n, size=min(n, sample_size), replace=False)
+    centroids = _kmeans_plus_plus(np.asarray(matrix[np.sort(sample_idx)], dtype=np.float32), n_clusters, rng)
+
+    labels = np.full(n, -1, dtype=np.int64)
+    for _ in range(iterations):
+        new_labels, sims = assign_to_centroids(matrix, centroids, block_rows)
+        changed = np.count_nonzero(new_labels != labels)
+        labels = new_labels
+        sums = np.zeros_like(centroids)
+        for r0 in range(0, n, block_rows):
+            np.add.at(sums, labels[r0:r0 + block_rows], np.asarray(matrix[r0:r0 + block_rows], dtype=np.float32))
+        empty = np.linalg.norm(sums, axis=1) == 0
+        # Re-seed empty clusters with the rows furthest from their centroid
+        if empty.any():
+            sums[empty] = np.asarray(matrix[np.argsort(sims)[:empty.sum()]], dtype=np.float32)
+        centroids = normalize_rows(sums)
+        if changed <= n // 1000:
+            break
+    labels, sims = assign_to_centroids(matrix, centroids, block_rows)
+    return labels, sims, centroids
+
+
+def default_cluster_count(n):
+    return int(max(2, min(200, round(np.sqrt(n / 2)))))
+
+
+def label_clusters(labels, topics_by_row, top=3):
+    """Name each cluster after its most common topics."""
+    counters = {}
+    for label, topics in zip(labels, topics_by_row):
+        counters.setdefault(int(label), Counter()).update(t.strip() for t in topics or [] if t)
+    return {label: [t for t, _ in counter.most_common(top)] for label, counter in counters.items()}
+
+
+def _chunks(items, size=_WRITE_BATCH):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class GraphBuilder:
+    """Compute and store the neighbour graph and clusters for all entries."""
+
+    def __init__(self, supabase, settings=None, log=print):
+        self.supabase = supabase
+        self.settings = {**DEFAULT_GRAPH, **(settings or {})}
+        self.log = log
+
+    def _query(self, columns, count=None):
+        return self.supabase.table("entries").select(columns, count=count).not_.is_("embedding", "null")
+
+    def _load(self, with_topics=False, page_size=1000):
+        """Fetch embeddings page by page straight into a preallocated, normalized matrix.
+
+        Only ids (and topics) are kept per row, so peak memory is the float32
+        matrix plus one page of pgvector strings.
+        Returns (ids, topics list or None, matrix).
+        """
+        total = self._query("id", count="exact").limit(1).execute().count or 0
+        columns = "id, embedding" + (", topics:ai_analysis->topics" if with_topics else "")
+        ids, topics = [], [] if with_topics else None
+        matrix, start = None, 0
+        while True:
+            page = self._query(columns).order("id").range(start, start + page_size - 1).execute().data
+            for row in page:
+                if row.get("embedding") is None:
+                    continue
+                vector = _parse_embedding(row["embedding"])
+                if matrix is None:
+                    matrix = np.empty((max(total, 1), len(vector)), dtype=np.float32)
+                elif len(ids) == len(matrix):
+                    # Entries added since the count
+                    matrix = np.concatenate([matrix, np.empty_like(matrix[:max(page_size, len(matrix) // 8)])])
+                matrix[len(ids)] = vector
+                ids.append(row["id"])
+                if with_topics:
+                    topics.append(row.get("topics"))
+            if len(page) < page_size:
+                break
+            start += page_size
+        if matrix is None:
+            return [], topics, np.zeros((0, 0), dtype=np.float32)
+        matrix = matrix[:len(ids)]
+        _normalize_in_place(matrix)
+        return ids, topics, matrix
+
+    def _load_ids(self, entry_ids):
+        """Embeddings of the given entries as (ids, matrix); entries without one are skipped."""
+        rows = []
+        for chunk in _chunks(entry_ids, _ID_BATCH):
+            rows += self._query("id, embedding").in_("id", chunk).execute().data
+        return load_matrix(rows)
+
+    def _change_seq(self, desc=True):
+        """Newest (or oldest) entry_changes id, None when the outbox is empty."""
+        rows = self.supabase.table("entry_changes").select("id").order("id", desc=desc).limit(1).execute().data
+        return rows[0]["id"] if rows else None
+
+    def _last_change_seq(self):
+        rows = (self.supabase.table("graph_runs").select("change_seq").not_.is_("change_seq", "null")
+                .order("change_seq", desc=True).limit(1).execute().data)
+        return rows[0]["change_seq"] if rows else None
+
+    def _changed_since(self, cursor, page_size=1000):
+        """Entries inserted or updated after outbox id cursor, oldest first, and the newest id read."""
+        entry_ids, head = {}, cursor
+        while True:
+            rows = (self.supabase.table("entry_changes").select("id, entry_id, op")
+                    .gt("id", head).order("id").limit(page_size).execute().data)
+            for row in rows:
+                if row["op"] != "delete":
+                    entry_ids[str(row["entry_id"])] = None
+            if rows:
+                head = rows[-1]["id"]
+            if len(rows) < page_size:
+                return list(entry_ids), head
+
+    def _record_run(self, kind, change_seq, entries):
+        self.supabase.table("graph_runs").insert({
+            "kind": kind,
+            "change_seq": change_seq,
+            "entries": entries,
+            "finished_at": datetime.utcnow().isoformat(),
+        }).execute()
+
+    def full_refresh(self):
+        """Rebuild neighbours and clusters from every embedding."""
+        s = self.settings
+        # Read before loading: entries changed while the build runs are picked up again next time
+        change_seq = self._change_seq() or 0
+        ids, topics, matrix = self._load(with_topics=True)
+        if not ids:
+            self.log("No embeddings yet.")
+            return 0
+        self.log(f"Loaded {len(ids)} embeddings ({matrix.shape[1]} dims)")
+
+        indices, sims = top_k_neighbors(matrix, s["neighbors"], block_rows=s["block_rows"],
+                                        block_cols=s["block_cols"])
+        self._write_neighbors(ids, [[ids[j] for j in row] for row in indices], sims)
+        self.log("Neighbour graph written")
+
+        n_clusters = s["clusters"] or default_cluster_count(len(ids))
+        labels, centroid_sims, centroids = spherical_kmeans(matrix, n_clusters, s["kmeans_iterations"],
+                                                            block_rows=s["block_rows"])
+        labels = np.where(centroid_sims < s["noise_threshold"], UNCLUSTERED, labels)
+        names = label_clusters(labels, topics)
+        self._write_clusters(ids, labels, centroid_sims, centroids, names, replace=True)
+        self.log(f"{n_clusters} clusters written")
+
+        self._record_run("full", change_seq, len(ids))
+        return len(ids)
+
+    def incremental_refresh(self):
+        """Add entries inserted or updated since the last run to the graph and clusters.
+
+        The entries come from the entry_changes outbox past the last run's
+        id. They get their neighbours from a database vector search and are
+        linked back into their neighbours' lists; they join the nearest
+        existing cluster. Run full_refresh now and then to re-cluster. An
+        outbox id that commits after a later one was already read is only
+        picked up by the next full_refresh.
+        """
+        s = self.settings
+        cursor = self._last_change_seq()
+        oldest = self._change_seq(desc=False)
+        # No run yet, or the outbox was pruned past the last run
+        if cursor is None or (oldest is not None and oldest > cursor + 1):
+            return self.full_refresh()
+        entry_ids, head = self._changed_since(cursor)
+        ids, matrix = self._load_ids(entry_ids)
+        if not ids:
+            if head != cursor:
+                self._record_run("incremental", head, 0)
+            return 0
+
+        neighbor_lists, sim_lists = [], []
+        for entry_id, vector in zip(ids, matrix):
+            result = self.supabase.rpc("match_entries_filtered", {
+                "query_embedding": vector.tolist(),
+                "match_threshold": s["min_similarity"],
+                "match_count": s["neighbors"] + 1,
+                "include_archived": True,
+            }).execute()
+            hits = [(r["id"], r["similarity"]) for r in result.data if r["id"] != entry_id][:s["neighbors"]]
+            neighbor_lists.append([h[0] for h in hits])
+            sim_lists.append([h[1] for h in hits])
+        self._write_neighbors(ids, neighbor_lists, sim_lists)
+        self._link_back(ids, neighbor_lists, sim_lists)
+
+        clusters = self.supabase.table("topic_clusters").select("cluster_id, centroid").execute().data
+        if clusters:
+            cluster_ids = np.array([c["cluster_id"] for c in clusters])
+            centroids = normalize_rows(np.array(
+                [json.loads(c["centroid"]) if isinstance(c["centroid"], str) else c["centroid"] for c in clusters],
+                dtype=np.float32))
+            labels, sims = assign_to_centroids(matrix, centroids)
+            labels = np.where(sims < s["noise_threshold"], UNCLUSTERED, cluster_ids[labels])
+            self._write_clusters(ids, labels, sims)
+
+        self._record_run("incremental", head, len(ids))
+        return len(ids)
+
+    def _link_back(self, ids, neighbor_lists, sim_lists):
+        """Insert new entries into existing entries' neighbour lists where they rank."""
+        k = self.settings["neighbors"]
+        incoming = {}
+        for entry_id, neighbors, sims in zip(ids, neighbor_lists, sim_lists):
+            for other, sim in zip(neighbors, sims):
+                incoming.setdefault(other, []).append((entry_id, sim))
+        targets = [t for t in incoming if t not in set(ids)]
+        for chunk in _chunks(targets):
+            existing = (self.supabase.table("entry_neighbors").select("entry_id, neighbor_ids, similarities")
+                        .in_("entry_id", chunk).execute().data)
+            updates = []
+            for row in existing:
+                pairs = dict(zip(row["neighbor_ids"] or [], row["similarities"] or []))
+                pairs.update(incoming[row["entry_id"]])
+                best = sorted(pairs.items(), key=lambda p: -p[1])[:k]
+                updates.append({
+                    "entry_id": row["entry_id"],
+                    "neighbor_ids": [p[0] for p in best],
+                    "similarities": [float(p[1]) for p in best],
+                    "updated_at": datetime.utcnow().isoformat(),
+                })
+            if updates:
+                self.supabase.table("entry_neighbors").upsert(updates).execute()
+
+    def _write_neighbors(self, ids, neighbor_lists, sim_lists):
+        now = datetime.utcnow().isoformat()
+        min_sim = self.settings["min_similarity"]
+        records = []
+        for entry_id, neighbors, sims in zip(ids, neighbor_lists, sim_lists):
+            keep = [(n, float(v)) for n, v in zip(neighbors, sims) if v >= min_sim]
+            records.append({
+                "entry_id": entry_id,
+                "neighbor_ids": [n for n, _ in keep],
+                "similarities": [v for _, v in keep],
+                "updated_at": now,
+            })
+        for chunk in _chunks(records):
+            self.supabase.table("entry_neighbors").upsert(chunk).execute()
+
+    def _write_clusters(self, ids, labels, sims, centroids=None, names=None, replace=False):
+        now = datetime.utcnow().isoformat()
+        if replace:
+            self.supabase.table("topic_clusters").delete().gte("cluster_id", 0).execute()
+            sizes = Counter(int(label) for label in labels)
+            clusters = [{
+                "cluster_id": int(c),
+                "label": " · ".join(names.get(int(c), [])) or f"Cluster {c + 1}",
+                "top_topics": names.get(int(c), []),
+                "size": sizes.get(int(c), 0),
+                "centroid": centroids[c].tolist(),
+                "updated_at": now,
+            } for c in range(len(centroids))]
+            for chunk in _chunks(clusters, 50):
+                self.supabase.table("topic_clusters").upsert(chunk).execute()
+        records = [{
+            "entry_id": entry_id,
+            "cluster_id": int(label),
+            "similarity": float(sim),
+            "updated_at": now,
+        } for entry_id, label, sim in zip(ids, labels, sims)]
+        for chunk in _chunks(records):
+            self.supabase.table("entry_clusters").upsert(chunk).execute()
+        if not replace:
+            self.supabase.rpc("refresh_cluster_sizes", {}).execute()
+
+
+class GraphRefresher:
+    """Run incremental_refresh in the background shortly after entries change.
+
+    Subscribes to a change feed (changefeed.py). The first insert or update
+    starts a timer of refresh_delay_s; changes arriving before it fires are
+    handled by the same run, since the builder reads the outbox itself.
+    Runs never overlap. on_refresh(count) is called after a run that
+    processed entries, on the timer thread.
+    """
+
+    def __init__(self, builder, feed, on_refresh=None):
+        self.builder = builder
+        self.on_refresh = on_refresh
+        self.runs = 0
+        self.last_error = None
+        self._timer = None
+        self._lock = threading.Lock()
+        self._running = threading.Lock()
+        self._unsubscribe = feed.subscribe(self._on_change, ops=("insert", "update"))
+
+    def _on_change(self, events):
+        with self._lock:
+            if self._timer is None:
+                self._timer = threading.Timer(self.builder.settings["refresh_delay_s"], self.run)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def run(self):
+        with self._lock:
+            self._timer = None
+        with self._running:
+            try:
+                count = self.builder.incremental_refresh()
+                self.runs += 1
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                self.builder.log(f"Graph refresh error: {e}")
+                return 0
+        if count and self.on_refresh:
+            self.on_refresh(count)
+        return count
+
+    def stop(self):
+        self._unsubscribe()
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+
+def main():
+    from settings import create_supabase, load_secrets
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--full", action="store_true", help="rebuild everything")
+    mode.add_argument("--incremental", action="store_true", help="only new entries (default)")
+    parser.add_argument("--secrets", help="path to secrets.toml")
+    args = parser.parse_args()
+
+    secrets = load_secrets(args.secrets)
+    builder = GraphBuilder(create_supabase(secrets), dict(secrets.get("graph", {})))
+    count = builder.full_refresh() if args.full else builder.incremental_refresh()
+    print(f"Processed {count} entries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Load-testing harness for the Streamlit app (see loadtest/run.py)."""
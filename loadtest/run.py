@@ -0,0 +1,344 @@
+"""Concurrent-session load test of app.py against stubbed Supabase and Gemini.
+
+    python -m loadtest.run                                  # 1, 5, 10 and 20 users, 30 s each
+    python -m loadtest.run --users 10,40 --duration 60 --mix search=4,browse=3,add=1,admin=0.5
+    python -m loadtest.run --attachments --model-latency 1.5 --json report.json
+
+Each simulated user is an AppTest session driving the real script through
+the Add, Search, Browse and Admin pages, with think time between
+interactions. All sessions share this process, like users of one Streamlit
+server, so st.cache_resource objects (pipeline, clients, indexes) and
+st.cache_data entries are shared; only st.session_state is per user.
+
+For each user count the report shows:
+  - rerun latency p50/p95/p99 per flow (a flow is one or more reruns)
+  - process RSS, its growth per session and the size of each session_state
+  - waits for the stubbed database pool and model quota, and CPU use
+    (a Python process cannot use much more than 1.0 core for script code)
+and ends with the largest user count whose p95 rerun stays under --slo-ms.
+"""
+import argparse
+import gc
+import io
+import json
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from loadtest.stubs import Stubs, fake_text
+
+APP = Path(__file__).resolve().parent.parent / "app.py"
+PAGES = {"add": "➕ Add", "search": "🔍 Search", "browse": "📊 Browse", "admin": "🔧 Admin"}
+DEFAULT_MIX = "search=4,browse=3,add=1,admin=0.5"
+QUERIES = ["problem med inloggning", "export till excel", "feedback om priser", "api webhook",
+           "mobil notifikationer", "fakturor och billing", "onboarding av kunder", "roadmap"]
+
+
+def rss_bytes():
+    """Resident set size of this process."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def deep_sizeof(obj, seen=None):
+    """Approximate bytes held by obj, including DataFrames, images and buffers."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, Image.Image):
+        return obj.width * obj.height * len(obj.getbands())
+    if isinstance(obj, io.BytesIO):
+        return obj.getbuffer().nbytes
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(v, seen) for v in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in PAGES:
+            raise argparse.ArgumentTypeError(f"unknown flow {name!r}, expected one of {', '.join(PAGES)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def fake_user(n):
+    user = type("User", (), {"id": f"00000000-0000-4000-8000-{n:012d}", "email": f"user{n}@loadtest.local"})()
+    return type("Auth", (), {"user": user})()
+
+
+def fake_attachments(rng, csv_rows):
+    """A CSV export and a screenshot, shaped like the entries the Add page keeps."""
+    df = pd.DataFrame({"ticket": range(csv_rows), "text": [fake_text(rng, 12) for _ in range(csv_rows)]})
+    image = Image.new("RGB", (1280, 800), (rng.randint(0, 255), 120, 200))
+    return [
+        {"name": "export.csv", "file": io.BytesIO(df.to_csv(index=False).encode()), "type": "csv",
+         "preview": None, "processed": False},
+        {"name": "screenshot.png", "file": io.BytesIO(), "type": "image", "preview": image, "image": image,
+         "processed": False},
+    ]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def add(self, flow, seconds, error=None):
+        with self._lock:
+            self.latencies.setdefault(flow, []).append(seconds)
+            if error:
+                self.errors.setdefault(flow, {}).setdefault(error, 0)
+                self.errors[flow][error] += 1
+
+
+class Session:
+    """One simulated user: an AppTest session plus the flows it can run."""
+
+    def __init__(self, n, recorder, args):
+        from streamlit.testing.v1 import AppTest
+
+        self.rng = random.Random(n)
+        self.recorder = recorder
+        self.args = args
+        self.at = AppTest.from_file(str(APP), default_timeout=args.timeout)
+        self.at.session_state["user"] = fake_user(n)
+
+    def _run(self, flow):
+        start = time.perf_counter()
+        error = None
+        try:
+            self.at.run()
+            if self.at.exception:
+                error = self.at.exception[0].message.splitlines()[0][:120]
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"[:120]
+        self.recorder.add(flow, time.perf_counter() - start, error)
+
+    def _goto(self, flow):
+        self.at.selectbox(key="mobile_nav").set_value(PAGES[flow])
+        self._run(flow)
+
+    def open(self):
+        self._run("load")
+
+    def add(self):
+        self._goto("add")
+        self.at.text_area[0].set_value(fake_text(self.rng, self.rng.randint(20, 200)))
+        if self.args.attachments:
+            self.at.session_state["attachments"] = fake_attachments(self.rng, self.args.csv_rows)
+        next(b for b in self.at.button if b.label == "💾 Save").click()
+        self._run("add")
+
+    def search(self):
+        self._goto("search")
+        self.at.text_input(key="search_query").set_value(self.rng.choice(QUERIES))
+        self._run("search")
+
+    def browse(self):
+        self._goto("browse")
+
+    def admin(self):
+        self._goto("admin")
+
+    def session_state_bytes(self):
+        return deep_sizeof(dict(self.at.session_state.items()))
+
+
+def run_level(users, stubs, args):
+    """Run `users` concurrent sessions for args.duration seconds and summarize."""
+    mix = args.mix
+    recorder = Recorder()
+    for resource in stubs.resources:
+        resource.reset()
+    gc.collect()
+    rss_before = rss_bytes()
+    cpu_before, wall_before = time.process_time(), time.perf_counter()
+    deadline = wall_before + args.ramp + args.duration
+    sessions = [None] * users
+
+    def user_loop(n):
+        # Stagger logins over the ramp-up period
+        time.sleep(args.ramp * n / max(users, 1))
+        session = sessions[n] = Session(n, recorder, args)
+        session.open()
+        flows, weights = list(mix), list(mix.values())
+        while time.perf_counter() < deadline:
+            flow = session.rng.choices(flows, weights)[0]
+            try:
+                getattr(session, flow)()
+            except Exception as e:  # e.g. a widget missing after a failed rerun
+                recorder.add(flow, 0.0, f"{type(e).__name__}: {e}"[:120])
+                session.open()
+            time.sleep(session.rng.expovariate(1 / args.think) if args.think else 0)
+
+    threads = [threading.Thread(target=user_loop, args=(n,), daemon=True) for n in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - wall_before
+    cpu = time.process_time() - cpu_before
+
+    gc.collect()
+    rss_after = rss_bytes()
+    state_sizes = [s.session_state_bytes() for s in sessions if s is not None]
+    all_latencies = [v for flow, values in recorder.latencies.items() if flow != "load" for v in values]
+    level = {
+        "users": users,
+        "reruns": sum(len(v) for v in recorder.latencies.values()),
+        "reruns_per_s": round(sum(len(v) for v in recorder.latencies.values()) / wall, 2),
+        "p95_ms": round(float(np.percentile(all_latencies, 95)) * 1000) if all_latencies else None,
+        "flows": {
+            flow: {
+                "count": len(values),
+                "p50_ms": round(float(np.percentile(values, 50)) * 1000),
+                "p95_ms": round(float(np.percentile(values, 95)) * 1000),
+                "p99_ms": round(float(np.percentile(values, 99)) * 1000),
+                "errors": sum(recorder.errors.get(flow, {}).values()),
+            }
+            for flow, values in sorted(recorder.latencies.items())
+        },
+        "errors": recorder.errors,
+        "rss_mb": round(rss_after / 2**20, 1),
+        "rss_per_session_mb": round((rss_after - rss_before) / max(users, 1) / 2**20, 2),
+        "session_state_kb": {
+            "median": round(float(np.median(state_sizes)) / 1024, 1) if state_sizes else 0,
+            "max": round(max(state_sizes, default=0) / 1024, 1),
+        },
+        "cpu_cores": round(cpu / wall, 2),
+        "upstreams": [r.stats() for r in stubs.resources],
+    }
+    del sessions
+    gc.collect()
+    return level
+
+
+def print_level(level):
+    print(f"\n=== {level['users']} users: {level['reruns']} reruns ({level['reruns_per_s']}/s), "
+          f"CPU {level['cpu_cores']} cores")
+    print(pd.DataFrame(level["flows"]).T.to_string())
+    print(f"RSS {level['rss_mb']} MB, +{level['rss_per_session_mb']} MB per session; "
+          f"session_state median {level['session_state_kb']['median']} KB, max {level['session_state_kb']['max']} KB")
+    print(pd.DataFrame(level["upstreams"]).to_string(index=False))
+    for flow, errors in level["errors"].items():
+        for message, count in errors.items():
+            print(f"  {flow}: {count}x {message}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test with stubbed backends")
+    parser.add_argument("--users", default="1,5,10,20", help="comma-separated concurrent user counts")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per user count, after ramp-up")
+    parser.add_argument("--ramp", type=float, default=5, help="seconds over which users log in")
+    parser.add_argument("--think", type=float, default=2.0, help="mean think time between interactions (s)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"flow weights ({DEFAULT_MIX})")
+    parser.add_argument("--entries", type=int, default=2000, help="entries seeded in the fake database")
+    parser.add_argument("--attachments", action="store_true", help="attach a CSV and an image to every Add")
+    parser.add_argument("--csv-rows", type=int, default=5000, help="rows in the attached CSV")
+    parser.add_argument("--db-latency", type=float, default=0.02, help="seconds per database call")
+    parser.add_argument("--db-pool", type=int, default=10, help="concurrent database calls")
+    parser.add_argument("--model-latency", type=float, default=0.8, help="seconds per Gemini call")
+    parser.add_argument("--model-concurrency", type=int, default=8, help="concurrent Gemini calls (quota)")
+    parser.add_argument("--embed-latency", type=float, default=0.15, help="seconds per embedding call")
+    parser.add_argument("--slo-ms", type=float, default=2000, help="p95 rerun latency target")
+    parser.add_argument("--timeout", type=float, default=120, help="AppTest timeout per rerun (s)")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    stubs = Stubs({
+        "db_latency_s": args.db_latency,
+        "db_pool": args.db_pool,
+        "model_latency_s": args.model_latency,
+        "model_concurrency": args.model_concurrency,
+        "embed_latency_s": args.embed_latency,
+    }).install()
+    user_counts = [int(u) for u in args.users.split(",")]
+    stubs.db.seed(args.entries, [fake_user(n).user.id for n in range(max(user_counts))],
+                  stubs.settings["dimensions"])
+    secrets = {
+        "supabase": {"url": "http://loadtest.invalid", "key": "loadtest"},
+        "gemini": {"api_key": "loadtest"},
+        "access": {"admin_emails": [fake_user(n).user.email for n in range(max(user_counts))]},
+        "changefeed": {"poll_interval_s": 1.0},
+    }
+    # The app imports its sibling modules by name
+    sys.path.insert(0, str(APP.parent))
+    _prepare_streamlit(secrets)
+
+    print(f"Seeded {args.entries} entries; flows {args.mix}; think {args.think}s; "
+          f"{args.duration}s per level after {args.ramp}s ramp-up")
+    report = []
+    for users in user_counts:
+        level = run_level(users, stubs, args)
+        print_level(level)
+        report.append(level)
+
+    within = [lvl["users"] for lvl in report if lvl["p95_ms"] is not None and lvl["p95_ms"] <= args.slo_ms]
+    print(f"\nLargest user count with p95 rerun <= {args.slo_ms:.0f} ms: {max(within) if within else 'none'}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items()}, "levels": report}, f, indent=2, default=str)
+
+
+def _prepare_streamlit(secrets):
+    """Make concurrent AppTest sessions behave like sessions of one server.
+
+    Around each rerun AppTest swaps st.secrets in and out, sets and then
+    clears a mock Runtime holding a fresh st.cache_data store, and compiles
+    the script again. With many threads that races (and concurrent
+    ast.parse calls can fail outright), and caches are not shared. Install
+    the secrets once, keep the first mock Runtime for every session and
+    compile the script once, as a server does.
+    """
+    import streamlit as st
+    from streamlit import config
+    from streamlit.logger import set_log_level
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.secrets import Secrets
+    from streamlit.testing.v1 import app_test, local_script_runner
+
+    config.set_option("logger.level", "error")
+    set_log_level("error")
+    st.secrets = Secrets()
+    st.secrets._secrets = secrets
+
+    class StickyInstance(type):
+        def __setattr__(cls, name, value):
+            if name != "_instance":
+                super().__setattr__(name, value)
+            elif value is not None and Runtime._instance is None:
+                Runtime._instance = value
+
+    app_test.Runtime = StickyInstance("Runtime", (Runtime,), {})
+    script_cache = app_test.ScriptCache()
+    script_cache.get_bytecode(str(APP))
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: script_cache
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,480 @@
+"""In-process stand-ins for Supabase and Gemini, with latency and concurrency limits.
+
+The fake database implements the subset of the PostgREST query builder the
+app uses, the match_entries_filtered RPC and the entry_changes trigger.
+Each upstream is a Resource: calls sleep for a jittered latency while
+holding one of a limited number of slots, and waits for a slot are
+recorded as contention.
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import numpy as np
+
+DEFAULT_STUBS = {
+    "db_latency_s": 0.02,
+    "db_pool": 10,
+    "model_latency_s": 0.8,
+    "model_concurrency": 8,
+    "embed_latency_s": 0.15,
+    "embed_concurrency": 8,
+    "dimensions": 768,
+}
+
+CATEGORIES = ["Feedback", "Idea", "Bug Report", "Meeting Notes", "Research", "Question", "Documentation"]
+WORDS = ("login export invoice dashboard onboarding pricing latency mobile search report customer "
+         "integration billing outage roadmap survey support ticket release sync password import "
+         "calendar notification permissions analytics api webhook backup translation").split()
+# Fields whose change fires the entry_changes trigger (see the migration)
+TRACKED_FIELDS = ("content", "ai_analysis", "archived", "file_type", "file_name")
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+class Resource:
+    """A stubbed upstream: fixed-size slot pool plus jittered service latency."""
+
+    def __init__(self, name, latency_s, concurrency):
+        self.name = name
+        self.latency_s = latency_s
+        self.concurrency = concurrency
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.in_flight = 0
+            self.max_in_flight = 0
+            self.waits = []
+            self.services = []
+
+    @contextmanager
+    def use(self):
+        requested = time.perf_counter()
+        with self._slots:
+            acquired = time.perf_counter()
+            with self._lock:
+                self.calls += 1
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                if self.latency_s:
+                    time.sleep(self.latency_s * random.uniform(0.5, 1.5))
+                yield
+            finally:
+                done = time.perf_counter()
+                with self._lock:
+                    self.in_flight -= 1
+                    self.waits.append(acquired - requested)
+                    self.services.append(done - acquired)
+
+    def stats(self):
+        with self._lock:
+            waits, services = list(self.waits), list(self.services)
+        return {
+            "resource": self.name,
+            "slots": self.concurrency,
+            "calls": self.calls,
+            "max_in_flight": self.max_in_flight,
+            "wait_p50_ms": round(_percentile(waits, 50) * 1000, 1),
+            "wait_p95_ms": round(_percentile(waits, 95) * 1000, 1),
+            "service_mean_ms": round(float(np.mean(services)) * 1000, 1) if services else 0.0,
+        }
+
+
+def fake_embedding(text, dims):
+    """Deterministic bag-of-words vector, so similar texts get similar vectors."""
+    vec = np.zeros(dims, dtype=np.float32)
+    for word in re.findall(r"\w+", str(text).lower()):
+        h = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+        vec[h % dims] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = np.linalg.norm(vec)
+    return (vec / norm if norm else vec).tolist()
+
+
+def fake_text(rng, words=40):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def fake_analysis(text):
+    rng = random.Random(text)
+    topics = sorted({w for w in re.findall(r"\w+", text.lower()) if w in WORDS})[:5] or ["general"]
+    return {
+        "summary": text[:160],
+        "topics": topics,
+        "entities": [f"Customer {rng.randint(1, 40)}"],
+        "category": rng.choice(CATEGORIES),
+        "sentiment": rng.choice(["positive", "negative", "neutral", "mixed"]),
+        "action_items": [],
+        "key_points": topics[:2],
+        "confidence": 0.9,
+    }
+
+
+# Database
+
+def _get_path(row, column):
+    """Read "col", "col->key" (JSON) or "col->>key" (text) from a row."""
+    match = re.fullmatch(r"(\w+)(?:(->>?)(\w+))?", column.strip())
+    name, arrow, key = match.groups()
+    value = row.get(name)
+    if arrow:
+        value = (value or {}).get(key) if isinstance(value, dict) else None
+        if arrow == "->>" and value is not None and not isinstance(value, str):
+            value = json.dumps(value)
+    return value
+
+
+def _matches(row, column, op, value):
+    actual = _get_path(row, column)
+    if op == "eq":
+        return actual == value
+    if op == "neq":
+        return actual != value
+    if op == "is":
+        return actual is None if value == "null" else actual is value
+    if op == "in":
+        return actual in value
+    if op == "cs":
+        wanted = json.loads(value) if isinstance(value, str) else value
+        return isinstance(actual, list) and all(w in actual for w in wanted)
+    if actual is None:
+        return False
+    return {"gt": actual > value, "gte": actual >= value, "lt": actual < value, "lte": actual <= value}[op]
+
+
+def _project(row, columns):
+    if columns.strip() == "*":
+        return dict(row)
+    result = {}
+    for column in columns.split(","):
+        alias, _, path = column.strip().rpartition(":")
+        path = path.strip()
+        key = alias or re.split(r"->>?", path)[-1]
+        result[key] = _get_path(row, path)
+    return result
+
+
+class FakeQuery:
+    """The chained PostgREST builder subset used by the app and batch jobs."""
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.action = "select"
+        self.columns = "*"
+        self.count = None
+        self.payload = None
+        self.on_conflict = None
+        self.filters = []
+        self.ordering = []
+        self.bounds = None
+        self.one = False
+        self._negate = False
+
+    def select(self, columns="*", count=None):
+        self.columns, self.count = columns, count
+        return self
+
+    def insert(self, data):
+        self.action, self.payload = "insert", data
+        return self
+
+    def upsert(self, data, on_conflict=None, **kwargs):
+        self.action, self.payload, self.on_conflict = "upsert", data, on_conflict
+        return self
+
+    def update(self, data):
+        self.action, self.payload = "update", data
+        return self
+
+    def delete(self):
+        self.action = "delete"
+        return self
+
+    @property
+    def not_(self):
+        self._negate = True
+        return self
+
+    def _filter(self, column, op, value):
+        self.filters.append((column, op, value, self._negate))
+        self._negate = False
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, "eq", value)
+
+    def neq(self, column, value):
+        return self._filter(column, "neq", value)
+
+    def gt(self, column, value):
+        return self._filter(column, "gt", value)
+
+    def gte(self, column, value):
+        return self._filter(column, "gte", value)
+
+    def lt(self, column, value):
+        return self._filter(column, "lt", value)
+
+    def lte(self, column, value):
+        return self._filter(column, "lte", value)
+
+    def in_(self, column, values):
+        return self._filter(column, "in", list(values))
+
+    def is_(self, column, value):
+        return self._filter(column, "is", value)
+
+    def filter(self, column, op, value):
+        return self._filter(column, op, value)
+
+    def or_(self, expression):
+        return self  # Only used by the snapshot exporter; treated as no filter
+
+    def order(self, column, desc=False, **kwargs):
+        self.ordering.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self.bounds = (0, count)
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end - start + 1)
+        return self
+
+    def single(self):
+        self.one = True
+        return self
+
+    def _select_rows(self, rows):
+        rows = [r for r in rows if all(_matches(r, c, op, v) != neg for c, op, v, neg in self.filters)]
+        for column, desc in reversed(self.ordering):
+            rows.sort(key=lambda r: ((v := _get_path(r, column)) is None, "" if v is None else v), reverse=desc)
+        return rows
+
+    def execute(self):
+        with self.db.resource.use():
+            data, count = self.db.apply(self)
+        if self.one:
+            data = data[0] if data else None
+        return SimpleNamespace(data=data, count=count)
+
+
+class FakeRPC:
+    def __init__(self, db, name, params):
+        self.db, self.name, self.params = db, name, params
+
+    def execute(self):
+        with self.db.resource.use():
+            if self.name == "match_entries_filtered":
+                return SimpleNamespace(data=self.db.match_entries(**self.params), count=None)
+            return SimpleNamespace(data=[], count=None)
+
+
+class FakeDatabase:
+    """Tables as lists of dicts behind one lock, with the entry_changes trigger."""
+
+    def __init__(self, resource):
+        self.resource = resource
+        self.tables = {}
+        self._lock = threading.Lock()
+        self._change_seq = 0
+        self._matrix = {}  # use_next -> (rows, matrix), rebuilt after writes
+
+    def rows(self, table):
+        return self.tables.setdefault(table, [])
+
+    def _record_change(self, entry_id, op):
+        self._change_seq += 1
+        self.rows("entry_changes").append({
+            "id": self._change_seq, "entry_id": entry_id, "op": op,
+            "changed_at": datetime.now(timezone.utc).isoformat(),
+        })
+        return self._change_seq
+
+    def _key(self, query, row):
+        if query.on_conflict:
+            return query.on_conflict
+        return next(k for k in ("id", "entry_id", "cluster_id", "target") if k in row)
+
+    def apply(self, query):
+        with self._lock:
+            rows = self.rows(query.table)
+            if query.action == "select":
+                selected = query._select_rows(rows)
+                count = len(selected) if query.count else None
+                if query.bounds:
+                    start, size = query.bounds
+                    selected = selected[start:start + size]
+                return [_project(r, query.columns) for r in selected], count
+
+            if query.table == "entries":
+                self._matrix.clear()
+            payload = query.payload if isinstance(query.payload, list) else [query.payload]
+            if query.action == "insert":
+                written = []
+                for item in payload:
+                    row = {"id": str(uuid.uuid4()), "archived": False, "updated_at": None,
+                           "created_at": datetime.now(timezone.utc).isoformat(), **item}
+                    if query.table == "entries":
+                        row["change_seq"] = self._record_change(row["id"], "insert")
+                    rows.append(row)
+                    written.append(dict(row))
+                return written, None
+            if query.action == "upsert":
+                written = []
+                for item in payload:
+                    key = self._key(query, item)
+                    existing = next((r for r in rows if r.get(key) == item[key]), None)
+                    if existing is None:
+                        rows.append(dict(item))
+                    else:
+                        existing.update(item)
+                    written.append(dict(item))
+                return written, None
+
+            matched = query._select_rows(rows)
+            if query.action == "update":
+                for row in matched:
+                    changed = any(k in TRACKED_FIELDS and row.get(k) != v for k, v in query.payload.items())
+                    row.update(query.payload)
+                    if query.table == "entries":
+                        row["updated_at"] = datetime.now(timezone.utc).isoformat()
+                        if changed:
+                            row["change_seq"] = self._record_change(row["id"], "update")
+                return [dict(r) for r in matched], None
+            ids = {id(r) for r in matched}
+            self.tables[query.table] = [r for r in rows if id(r) not in ids]
+            if query.table == "entries":
+                for row in matched:
+                    self._record_change(row["id"], "delete")
+            return [dict(r) for r in matched], None
+
+    def match_entries(self, query_embedding, match_threshold=0.5, match_count=10, include_archived=False,
+                      filter_category=None, filter_file_type=None, created_after=None, created_before=None,
+                      filter_user_id=None, use_next=False):
+        column = "embedding_next" if use_next else "embedding"
+        with self._lock:
+            if use_next not in self._matrix:
+                rows = [r for r in self.rows("entries") if r.get(column) is not None]
+                matrix = np.asarray([r[column] for r in rows], dtype=np.float32).reshape(len(rows), -1)
+                self._matrix[use_next] = (rows, matrix)
+            rows, matrix = self._matrix[use_next]
+        if not rows:
+            return []
+        sims = matrix @ np.asarray(query_embedding, dtype=np.float32)
+        results = []
+        for i in np.argsort(-sims):
+            row = rows[i]
+            if sims[i] < match_threshold or len(results) >= match_count:
+                break
+            ai = row.get("ai_analysis") or {}
+            if (not include_archived and row.get("archived")) \
+                    or (filter_category and ai.get("category") != filter_category) \
+                    or (filter_file_type and row.get("file_type") != filter_file_type) \
+                    or (created_after and row["created_at"] < created_after) \
+                    or (created_before and row["created_at"] >= created_before) \
+                    or (filter_user_id and row.get("user_id") != filter_user_id):
+                continue
+            results.append({k: row.get(k) for k in ("id", "user_id", "content", "ai_analysis", "file_type",
+                                                     "file_name", "created_at", "archived")}
+                           | {"embedding": row[column], "similarity": float(sims[i])})
+        return results
+
+    def seed(self, count, user_ids, dims, seed=1):
+        """Insert `count` analyzed and embedded entries spread over the last year."""
+        rng = random.Random(seed)
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            rows = self.rows("entries")
+            for _ in range(count):
+                content = fake_text(rng, rng.randint(20, 120))
+                rows.append({
+                    "id": str(uuid.uuid4()),
+                    "user_id": rng.choice(user_ids),
+                    "content": content,
+                    "ai_analysis": fake_analysis(content),
+                    "file_type": None,
+                    "file_name": None,
+                    "embedding": fake_embedding(content, dims),
+                    "embedding_model": "models/gemini-embedding-001",
+                    "embedding_version": 1,
+                    "archived": rng.random() < 0.1,
+                    "created_at": (now - timedelta(minutes=rng.randint(0, 525600))).isoformat(),
+                    "updated_at": None,
+                })
+            self._matrix.clear()
+
+
+class FakeSupabase:
+    def __init__(self, db):
+        self.db = db
+        self.auth = None
+
+    def table(self, name):
+        return FakeQuery(self.db, name)
+
+    def rpc(self, name, params=None):
+        return FakeRPC(self.db, name, params or {})
+
+
+# Gemini
+
+class FakeModel:
+    def __init__(self, stubs, model_name, **kwargs):
+        self.stubs = stubs
+        self.model_name = model_name
+
+    def generate_content(self, contents, generation_config=None, request_options=None, **kwargs):
+        with self.stubs.model.use():
+            if isinstance(contents, list):
+                return SimpleNamespace(text="A screenshot of a dashboard with a table of support tickets.")
+            if "Return a JSON object" in contents:
+                text = contents.split("Content:", 1)[-1]
+                return SimpleNamespace(text=json.dumps(fake_analysis(text)))
+            return SimpleNamespace(text="Resultaten handlar främst om inloggning och export.")
+
+
+class Stubs:
+    """Shared fake upstreams; install() patches supabase.create_client and genai."""
+
+    def __init__(self, settings=None):
+        self.settings = {**DEFAULT_STUBS, **(settings or {})}
+        s = self.settings
+        self.database = Resource("database", s["db_latency_s"], s["db_pool"])
+        self.model = Resource("gemini", s["model_latency_s"], s["model_concurrency"])
+        self.embedder = Resource("embeddings", s["embed_latency_s"], s["embed_concurrency"])
+        self.db = FakeDatabase(self.database)
+
+    @property
+    def resources(self):
+        return [self.database, self.model, self.embedder]
+
+    def embed_content(self, model=None, content=None, task_type=None, output_dimensionality=None, **kwargs):
+        with self.embedder.use():
+            return {"embedding": fake_embedding(content, output_dimensionality or self.settings["dimensions"])}
+
+    def install(self):
+        import google.generativeai as genai
+        import supabase
+
+        supabase.create_client = lambda url, key, *args, **kwargs: FakeSupabase(self.db)
+        genai.configure = lambda **kwargs: None
+        genai.GenerativeModel = lambda model_name, **kwargs: FakeModel(self, model_name, **kwargs)
+        genai.embed_content = self.embed_content
+        genai.list_models = lambda **kwargs: []
+        return self
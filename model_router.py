@@ -0,0 +1,194 @@
+"""Size-aware routing between a small and a large Gemini model."""
+import json
+import threading
+import time
+from collections.abc import Mapping
+
+import google.generativeai as genai
+
+from resilience import ResilientCaller
+
+# Defaults - override in secrets.toml under [models]
+DEFAULT_POLICY = {
+    "small_model": "gemma-3-4b-it",
+    "large_model": "gemma-3-27b-it",
+    # Inputs up to this size go to the small model
+    "small_max_chars": 1500,
+    "small_max_lines": 25,
+    # Escalate to the large model when the small one fails or is unsure
+    "escalate": True,
+    "min_confidence": 0.6,
+    # Force a tier per task, e.g. {"image": "large"}
+    "routes": {"image": "large"},
+    # Ask for JSON with a response schema: through JSON mode on Gemini models,
+    # in the prompt on models without it (the Gemma defaults)
+    "structured_output": True,
+    # USD per 1M tokens, used for the cost estimate on the Admin page
+    "cost_per_mtok": {
+        "small": {"input": 0.0, "output": 0.0},
+        "large": {"input": 0.0, "output": 0.0},
+    },
+}
+
+LATENCY_WINDOW = 500
+
+
+def load_policy(overrides=None):
+    """Merge user overrides into the default routing policy."""
+    policy = {k: (dict(v) if isinstance(v, dict) else v) for k, v in DEFAULT_POLICY.items()}
+    for key, value in (overrides or {}).items():
+        if isinstance(value, Mapping) and isinstance(policy.get(key), dict):
+            policy[key].update({k: dict(v) if isinstance(v, Mapping) else v for k, v in value.items()})
+        else:
+            policy[key] = value
+    return policy
+
+
+def supports_structured_output(model_name):
+    """Gemini models have JSON mode with a response schema, Gemma models do not."""
+    return model_name.split("/")[-1].startswith("gemini")
+
+
+def schema_prompt(prompt, schema):
+    """Append the response schema to a prompt (text or list of parts) for models without JSON mode."""
+    instruction = f"\n\nThe JSON object must match this JSON schema:\n{json.dumps(schema)}"
+    if isinstance(prompt, str):
+        return prompt + instruction
+    return [*prompt, instruction.lstrip()]
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class ModelRouter:
+    """Pick the small or large model per call and keep per-route stats.
+
+    Short or simple inputs go to the small model. If the caller's accept
+    check rejects the small model's answer (parse failure, low confidence)
+    the same prompt is retried on the large model.
+    """
+
+    def __init__(self, policy=None, model_factory=None, resilience=None):
+        self.policy = load_policy(policy)
+        factory = model_factory or genai.GenerativeModel
+        self.models = {
+            "small": factory(self.policy["small_model"]),
+            "large": factory(self.policy["large_model"]),
+        }
+        # Deadline, hedging and circuit breaker per tier
+        self.guards = {
+            tier: ResilientCaller(f"{tier} model", resilience)
+            for tier in self.models
+        }
+        self._lock = threading.Lock()
+        self._stats = {
+            tier: {"calls": 0, "errors": 0, "escalations": 0,
+                   "input_tokens": 0, "output_tokens": 0, "latencies": []}
+            for tier in self.models
+        }
+
+    def model_name(self, tier):
+        return self.policy[f"{tier}_model"]
+
+    def choose(self, content, task="analyze"):
+        """Return "small" or "large" for this input."""
+        forced = self.policy.get("routes", {}).get(task)
+        if forced in self.models:
+            return forced
+        if not isinstance(content, str):
+            return "large"
+        if len(content) > self.policy["small_max_chars"]:
+            return "large"
+        if content.count("\n") + 1 > self.policy["small_max_lines"]:
+            return "large"
+        return "small"
+
+    def call(self, tier, prompt, schema=None, **kwargs):
+        """Call one tier directly and record latency, tokens and errors.
+
+        With a `schema`, models that support it are asked for JSON matching
+        that response schema; others get the schema appended to the prompt.
+        """
+        guard = self.guards[tier]
+        if schema is not None and self.policy["structured_output"]:
+            if supports_structured_output(self.model_name(tier)):
+                kwargs.setdefault("generation_config", {
+                    "response_mime_type": "application/json",
+                    "response_schema": schema,
+                })
+            else:
+                prompt = schema_prompt(prompt, schema)
+        kwargs.setdefault("request_options", {"timeout": guard.settings["deadline_s"]})
+        start = time.perf_counter()
+        try:
+            response = guard(self.models[tier].generate_content, prompt, **kwargs)
+        except Exception:
+            self._record(tier, time.perf_counter() - start, error=True)
+            raise
+        self._record(tier, time.perf_counter() - start, response=response)
+        return response
+
+    def generate(self, prompt, content=None, task="analyze", accept=None, **kwargs):
+        """Route a prompt and escalate to the large model when needed.
+
+        `content` is what gets measured for routing (defaults to the prompt).
+        `accept(response)` returns False when the answer is not good enough.
+        A small model that times out or has its circuit open also escalates.
+        Returns (response, tier).
+        """
+        tier = self.choose(prompt if content is None else content, task)
+        if tier == "large" or not self.policy["escalate"]:
+            return self.call(tier, prompt, **kwargs), tier
+
+        try:
+            response = self.call("small", prompt, **kwargs)
+            if accept is None or accept(response):
+                return response, "small"
+        except Exception:
+            pass
+        self._bump("small", "escalations")
+        return self.call("large", prompt, **kwargs), "large"
+
+    def _bump(self, tier, key, amount=1):
+        with self._lock:
+            self._stats[tier][key] += amount
+
+    def _record(self, tier, elapsed, response=None, error=False):
+        usage = getattr(response, "usage_metadata", None)
+        with self._lock:
+            stats = self._stats[tier]
+            stats["calls"] += 1
+            if error:
+                stats["errors"] += 1
+            stats["latencies"].append(elapsed)
+            del stats["latencies"][:-LATENCY_WINDOW]
+            if usage is not None:
+                stats["input_tokens"] += getattr(usage, "prompt_token_count", 0) or 0
+                stats["output_tokens"] += getattr(usage, "candidates_token_count", 0) or 0
+
+    def stats(self):
+        """Per-route summary: calls, errors, escalations, latency and cost."""
+        rows = []
+        with self._lock:
+            for tier, stats in self._stats.items():
+                prices = self.policy["cost_per_mtok"].get(tier, {})
+                cost = (stats["input_tokens"] * prices.get("input", 0)
+                        + stats["output_tokens"] * prices.get("output", 0)) / 1_000_000
+                rows.append({
+                    "route": tier,
+                    "model": self.model_name(tier),
+                    "calls": stats["calls"],
+                    "errors": stats["errors"],
+                    "escalations": stats["escalations"],
+                    "p50_ms": round(_percentile(stats["latencies"], 50) * 1000),
+                    "p95_ms": round(_percentile(stats["latencies"], 95) * 1000),
+                    "input_tokens": stats["input_tokens"],
+                    "output_tokens": stats["output_tokens"],
+                    "est_cost_usd": round(cost, 4),
+                })
+        return rows
@@ -0,0 +1,467 @@
+"""Save, analyze, embed and search - shared by the Streamlit app and the API."""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import google.generativeai as genai
+
+from analysis import ANALYSIS_SCHEMA, AnalysisParseError, merge_records, parse_analysis
+from changefeed import create_change_feed
+from dedupe import DEFAULT_DEDUPE, LSHIndex
+from embeddings import DEFAULT_EMBEDDINGS, embed_text, load_specs
+from model_router import ModelRouter
+from ranking import DEFAULT_SEARCH, fuse_rankings, rerank
+from resilience import ResilientCaller
+from suggest import SuggestIndex
+from tokens import count_tokens, split_sections
+
+DEFAULT_ANALYSIS = {
+    # Content above this is analyzed section by section (map-reduce)
+    "section_tokens": 3000,
+    "max_sections": 12,
+    "parallel_sections": 4,
+}
+
+
+def _section(secrets, name):
+    return dict(secrets.get(name, {}))
+
+
+def _analysis_prompt(content, file_info=None):
+    return f"""Analyze the following content and extract structured information.
+Return a JSON object with these fields (include only what you can identify):
+- summary: Brief 1-2 sentence summary
+- topics: Array of main topics/themes
+- entities: Array of named entities (people, companies, products, etc.)
+- category: Best fitting category (e.g., "Feedback", "Idea", "Bug Report", "Meeting Notes", "Research", "Question", "Documentation", etc.)
+- sentiment: "positive", "negative", "neutral", or "mixed"
+- action_items: Array of any action items or tasks mentioned
+- key_points: Array of main takeaways
+- confidence: Number from 0 to 1, how confident you are in this analysis
+
+Content:
+{content}
+
+{f"File info: {file_info}" if file_info else ""}
+
+Respond with ONLY valid JSON, no markdown formatting."""
+
+
+class Pipeline:
+    """The ingest and search pipeline over one Supabase client and one model router.
+
+    Thread-safe: one instance is shared by every Streamlit session or API
+    request in a process. Configured from the same secrets sections as the
+    app ([models], [resilience], [analysis], [embeddings], [search], [dedupe],
+    [changefeed]). Every write is published on `changes`; call
+    `changes.start()` to also receive writes made by other processes.
+    """
+
+    def __init__(self, supabase, secrets):
+        self.supabase = supabase
+        resilience = _section(secrets, "resilience")
+        self.router = ModelRouter(_section(secrets, "models"), resilience=resilience)
+        self.embed_guard = ResilientCaller("embedding", resilience)
+        self.analysis = {**DEFAULT_ANALYSIS, **_section(secrets, "analysis")}
+        self.embeddings = {**DEFAULT_EMBEDDINGS, **_section(secrets, "embeddings")}
+        self.embedding, self.next_embedding = load_specs(self.embeddings)
+        self.search = {**DEFAULT_SEARCH, **_section(secrets, "search")}
+        self.dedupe = {**DEFAULT_DEDUPE, **_section(secrets, "dedupe")}
+        self._dedupe_index = None
+        self._dedupe_lock = threading.Lock()
+        self._suggest_index = None
+        self._suggest_lock = threading.Lock()
+        self.changes = create_change_feed(supabase, _section(secrets, "changefeed"))
+        self.changes.subscribe(self._update_dedupe_index)
+        self.changes.subscribe(self._update_suggest_index)
+
+    @classmethod
+    def from_secrets(cls, secrets):
+        """Configure Gemini and Supabase from secrets and build a pipeline."""
+        from supabase import create_client
+
+        genai.configure(api_key=secrets["gemini"]["api_key"])
+        supabase = create_client(secrets["supabase"]["url"], secrets["supabase"]["key"])
+        return cls(supabase, secrets)
+
+    @property
+    def model_name(self):
+        return self.router.model_name("large")
+
+    @property
+    def max_content_tokens(self):
+        return self.analysis["section_tokens"] * self.analysis["max_sections"]
+
+    # Analysis
+
+    def _analysis_accepted(self, response):
+        """Accept a small-model answer only if it parses and is confident enough."""
+        try:
+            record = parse_analysis(response.text)
+        except ValueError:
+            return False
+        if not record.category or record.repaired:
+            return False
+        confidence = 1.0 if record.confidence is None else record.confidence
+        return confidence >= self.router.policy["min_confidence"]
+
+    def _analyze_single(self, content, file_info=None):
+        """Analyze content in one model call. Returns (record, model name)."""
+        response, tier = self.router.generate(_analysis_prompt(content, file_info), content=content,
+                                              accept=self._analysis_accepted, schema=ANALYSIS_SCHEMA)
+        try:
+            return parse_analysis(response.text), self.router.model_name(tier)
+        except ValueError as e:
+            raise AnalysisParseError(f"JSON parse error: {e}", response.text[:500])
+
+    def _analyze_sections(self, content, file_info=None):
+        """Map-reduce analysis: analyze sections in parallel, then merge.
+
+        Sections past max_sections and sections whose call failed are left out;
+        the result then has _partial set, with _sections_skipped and
+        _sections_failed counts next to the _sections total.
+        """
+        all_sections = split_sections(content, self.analysis["section_tokens"])
+        sections = all_sections[:self.analysis["max_sections"]]
+        label = f"{file_info}, " if file_info else ""
+        with ThreadPoolExecutor(max_workers=self.analysis["parallel_sections"]) as pool:
+            futures = [
+                pool.submit(self._analyze_single, section, f"{label}section {i+1} of {len(sections)}")
+                for i, section in enumerate(sections)
+            ]
+            outcomes, error = [], None
+            for section, future in zip(sections, futures):
+                try:
+                    outcomes.append((section, *future.result()))
+                except Exception as e:
+                    error = e
+        if not outcomes:
+            raise error
+
+        merged = merge_records([record for _, record, _ in outcomes],
+                               weights=[count_tokens(section) for section, _, _ in outcomes])
+        # Reduce step: one short call to summarize the section summaries
+        section_summaries = "\n".join(f"- {record.summary}" for _, record, _ in outcomes if record.summary)
+        try:
+            response, _ = self.router.generate(
+                f"""These are summaries of consecutive sections of one document:
+{section_summaries}
+
+Write a brief 1-2 sentence summary of the whole document. Respond with the summary only.""",
+                content=section_summaries, task="summary")
+            merged.summary = response.text.strip() or merged.summary
+        except Exception:
+            pass  # Keep the joined section summaries
+
+        result = merged.to_dict()
+        result["_model"] = ", ".join(sorted({name for _, _, name in outcomes}))
+        result["_sections"] = len(all_sections)
+        skipped, failed = len(all_sections) - len(sections), len(sections) - len(outcomes)
+        if skipped or failed:
+            result.update({"_partial": True, "_sections_skipped": skipped, "_sections_failed": failed})
+        return result
+
+    def analyze_content(self, content, file_info=None):
+        """Use Gemini to analyze and extract metadata from content"""
+        try:
+            if count_tokens(content) > self.analysis["section_tokens"]:
+                return self._analyze_sections(content, file_info)
+            record, model_name = self._analyze_single(content, file_info)
+            result = record.to_dict()
+            result["_model"] = model_name
+            return result
+        except AnalysisParseError as e:
+            return {"error": str(e), "raw_response": e.raw_response, "summary": content[:200]}
+        except Exception as e:
+            return {"error": f"Model: {self.model_name} - {str(e)}", "summary": content[:200]}
+
+    def analyze_image(self, image):
+        """Analyze image using Gemini Vision"""
+        try:
+            response, _ = self.router.generate([
+                "Describe this image in detail. Extract any text visible. Identify what type of content this is.",
+                image
+            ], task="image")
+            return response.text
+        except Exception as e:
+            return f"Error analyzing image: {e}"
+
+    def summarize_results(self, prompt, summaries):
+        """Short summary of search results; routed by the size of the summaries."""
+        response, _ = self.router.generate(prompt, content="\n".join(summaries), task="summary")
+        return response.text
+
+    # Embeddings
+
+    def generate_embedding(self, text, spec=None):
+        """Generate embedding for semantic search"""
+        try:
+            return embed_text(text, spec or self.embedding, guard=self.embed_guard)
+        except Exception as e:
+            print(f"Embedding error: {e}")
+            return None
+
+    # Storage and dedupe
+
+    def fetch_all_entries(self, columns="*", page_size=1000):
+        """Fetch every entry, paging past the PostgREST row limit."""
+        rows = []
+        start = 0
+        while True:
+            page = (self.supabase.table("entries").select(columns).order("id")
+                    .range(start, start + page_size - 1).execute().data)
+            rows.extend(page)
+            if len(page) < page_size:
+                return rows
+            start += page_size
+
+    @property
+    def dedupe_index(self):
+        """MinHash/LSH index over existing entries, built on first use."""
+        with self._dedupe_lock:
+            if self._dedupe_index is None:
+                index = LSHIndex(self.dedupe)
+                for entry in self.fetch_all_entries("id, content"):
+                    index.add(entry["id"], entry["content"] or "")
+                self._dedupe_index = index
+            return self._dedupe_index
+
+    def _changed_rows(self, events, columns):
+        """Current rows for changed entries, and the ids that no longer exist."""
+        rows, missing = {}, []
+        for event in events:
+            if event.op == "delete":
+                rows.pop(event.entry_id, None)
+            elif event.row is not None:
+                rows[event.entry_id] = event.row
+            else:
+                missing.append(event.entry_id)
+        if missing:
+            fetched = self.supabase.table("entries").select(columns).in_("id", missing).execute().data
+            rows.update((str(row["id"]), row) for row in fetched)
+        gone = {event.entry_id for event in events} - set(rows)
+        return rows, gone
+
+    def _update_dedupe_index(self, events):
+        """Keep a built dedupe index in step with entry changes from any process."""
+        index = self._dedupe_index
+        if index is None:
+            return
+        rows, gone = self._changed_rows(events, "id, content")
+        for entry_id in gone:
+            index.remove(entry_id)
+        for entry_id, row in rows.items():
+            index.remove(entry_id)
+            index.add(entry_id, row.get("content") or "")
+
+    def find_lexical_duplicate(self, content):
+        """Existing entry with nearly the same wording, as (id, similarity)."""
+        if not self.dedupe["enabled"]:
+            return None
+        matches = self.dedupe_index.query(content)
+        return matches[0] if matches else None
+
+    def find_semantic_duplicate(self, embedding):
+        """Existing entry with a near-identical embedding, as (id, similarity)."""
+        if not self.dedupe["enabled"] or embedding is None:
+            return None
+        try:
+            result = self.supabase.rpc(
+                "match_entries_filtered",
+                {
+                    "query_embedding": embedding,
+                    "match_threshold": self.dedupe["semantic_threshold"],
+                    "match_count": 1,
+                    "include_archived": True,
+                }
+            ).execute()
+        except Exception as e:
+            print(f"Duplicate check error: {e}")
+            return None
+        if result.data:
+            return result.data[0]["id"], result.data[0]["similarity"]
+        return None
+
+    def save_entry(self, user_id, content, ai_analysis, file_type=None, file_name=None,
+                   embedding=None, duplicate_of=None):
+        """Save entry to Supabase"""
+        if embedding is None:
+            embedding = self.generate_embedding(content)
+
+        data = {
+            "user_id": user_id,
+            "content": content,
+            "ai_analysis": ai_analysis,
+            "file_type": file_type,
+            "file_name": file_name,
+            "embedding": embedding,
+            "embedding_model": self.embedding.model if embedding is not None else None,
+            "embedding_version": self.embedding.version if embedding is not None else None,
+            "created_at": datetime.utcnow().isoformat()
+        }
+        if duplicate_of:
+            data["duplicate_of"] = duplicate_of
+        # During an embedding migration new rows are written to both indexes
+        if self.next_embedding is not None:
+            next_embedding = self.generate_embedding(content, self.next_embedding)
+            if next_embedding is not None:
+                data["embedding_next"] = next_embedding
+                data["embedding_next_model"] = self.next_embedding.model
+                data["embedding_next_version"] = self.next_embedding.version
+
+        try:
+            result = self.supabase.table("entries").insert(data).execute()
+        except Exception as e:
+            return False, f"Error: {e}"
+        if result.data:
+            self.changes.notify(result.data[0]["id"], "insert", row=result.data[0])
+        return True, "Saved!"
+
+    def _update_entry(self, entry_id, data):
+        result = self.supabase.table("entries").update(data).eq("id", entry_id).execute()
+        if result.data:
+            self.changes.notify(entry_id, "update", row=result.data[0])
+
+    def set_archived(self, entry_id, archived=True):
+        self._update_entry(entry_id, {"archived": archived})
+
+    def update_analysis(self, entry_id, ai_analysis):
+        self._update_entry(entry_id, {"ai_analysis": ai_analysis})
+
+    def delete_entry(self, entry_id):
+        result = self.supabase.table("entries").delete().eq("id", entry_id).execute()
+        if result.data:
+            self.changes.notify(entry_id, "delete")
+
+    def handle_duplicate(self, user_id, existing_id, content, file_type=None, file_name=None, embedding=None):
+        """Skip, merge or link a duplicate without any model calls."""
+        try:
+            existing = self.supabase.table("entries").select(
+                "id, ai_analysis, embedding"
+            ).eq("id", existing_id).single().execute().data
+        except Exception as e:
+            return False, f"Error: {e}", {}
+        ai_analysis = existing.get("ai_analysis") or {}
+        action = self.dedupe["action"]
+
+        if action == "skip":
+            return True, "Already saved - skipped duplicate", ai_analysis
+        if action == "merge":
+            try:
+                self.supabase.rpc("increment_duplicate_count", {"target_id": existing_id}).execute()
+            except Exception as e:
+                return False, f"Error: {e}", ai_analysis
+            return True, "Merged into existing entry", ai_analysis
+        # link: save a new row that reuses the original's analysis and embedding
+        success, message = self.save_entry(user_id, content, ai_analysis, file_type, file_name,
+                                           embedding=embedding or existing.get("embedding"),
+                                           duplicate_of=existing_id)
+        return success, ("Saved (linked to existing entry)" if success else message), ai_analysis
+
+    def ingest_entry(self, user_id, content, file_type=None, file_name=None, file_info=None):
+        """Dedupe, analyze, embed and save content. Returns (success, message, ai_analysis).
+
+        The lexical check runs before any model call; the semantic check reuses
+        the embedding that is needed for saving anyway.
+        """
+        duplicate = self.find_lexical_duplicate(content)
+        if duplicate:
+            return self.handle_duplicate(user_id, duplicate[0], content, file_type, file_name)
+
+        embedding = self.generate_embedding(content)
+        duplicate = self.find_semantic_duplicate(embedding)
+        if duplicate:
+            return self.handle_duplicate(user_id, duplicate[0], content, file_type, file_name, embedding)
+
+        ai_analysis = self.analyze_content(content, file_info)
+        success, message = self.save_entry(user_id, content, ai_analysis, file_type, file_name,
+                                           embedding=embedding)
+        return success, message, ai_analysis
+
+    # Search
+
+    def _match_entries(self, query_embedding, limit, filters, use_next=False):
+        result = self.supabase.rpc(
+            "match_entries_filtered",
+            {
+                "query_embedding": query_embedding,
+                "match_threshold": self.search["min_threshold"],
+                "match_count": limit * self.search["fetch_factor"],
+                "include_archived": filters.get("include_archived", False),
+                "filter_category": filters.get("category"),
+                "filter_file_type": filters.get("file_type"),
+                "created_after": filters.get("created_after"),
+                "created_before": filters.get("created_before"),
+                "filter_user_id": filters.get("user_id"),
+                "use_next": use_next,
+            }
+        ).execute()
+        return rerank(result.data, query_embedding, limit, self.search)
+
+    def search_entries(self, query, limit=10, filters=None, on_error=None):
+        """Search entries using semantic similarity.
+
+        Filters (include_archived, category, file_type, created_after,
+        created_before, user_id) are applied in the database. Results are cut
+        with an adaptive threshold and diversified with MMR. During an
+        embedding migration both indexes can be read and the results fused.
+        Errors from one index are passed to `on_error` (default: raise).
+        """
+        filters = filters or {}
+        read = self.embeddings["read"] if self.next_embedding is not None else "current"
+        indexes = []
+        if read in ("current", "both"):
+            indexes.append((self.embedding, False))
+        if read in ("next", "both"):
+            indexes.append((self.next_embedding, True))
+
+        ranked_lists = []
+        for spec, use_next in indexes:
+            query_embedding = self.generate_embedding(query, spec)
+            if query_embedding is None:
+                continue
+            try:
+                ranked_lists.append(self._match_entries(query_embedding, limit, filters, use_next))
+            except Exception as e:
+                if on_error is None:
+                    raise
+                on_error(e)
+
+        if not ranked_lists:
+            return []
+        results = fuse_rankings(ranked_lists, limit)
+        for row in results:
+            row.pop("embedding", None)
+        return results
+
+    # Suggestions
+
+    @property
+    def suggest_index(self):
+        """Prefix index over topics, entities and categories of unarchived entries, built on first use."""
+        with self._suggest_lock:
+            if self._suggest_index is None:
+                rows = self.fetch_all_entries("id, ai_analysis, archived")
+                self._suggest_index = SuggestIndex.build(r for r in rows if not r.get("archived"))
+            return self._suggest_index
+
+    @property
+    def suggestions_ready(self):
+        return self._suggest_index is not None
+
+    def _update_suggest_index(self, events):
+        index = self._suggest_index
+        if index is None:
+            return
+        rows, gone = self._changed_rows(events, "id, ai_analysis, archived")
+        for entry_id in gone:
+            index.remove_entry(entry_id)
+        for entry_id, row in rows.items():
+            if row.get("archived"):
+                index.remove_entry(entry_id)
+            else:
+                index.add_entry(entry_id, row.get("ai_analysis"))
+
+    def suggest(self, prefix, limit=8, kinds=None):
+        """Known topics, entities and categories starting with prefix - no model calls."""
+        return self.suggest_index.suggest(prefix, limit, kinds)
@@ -0,0 +1,110 @@
+"""Result post-processing for semantic search: adaptive threshold and MMR."""
+import json
+
+import numpy as np
+
+DEFAULT_SEARCH = {
+    # Similarity used when the best match is strong
+    "threshold": 0.65,
+    # Never go below this, even for weak queries
+    "min_threshold": 0.5,
+    # Keep results within this distance of the best match
+    "relative_margin": 0.15,
+    # Fetch this many times the page size before diversifying
+    "fetch_factor": 4,
+    # MMR trade-off: 1.0 = pure relevance, 0.0 = pure diversity
+    "mmr_lambda": 0.7,
+}
+
+
+def parse_embedding(value):
+    """pgvector columns arrive as "[0.1,0.2,...]" strings through PostgREST."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = json.loads(value)
+    return np.asarray(value, dtype=np.float32)
+
+
+def adaptive_threshold(similarities, threshold=0.65, min_threshold=0.5, relative_margin=0.15):
+    """Cut-off that relaxes for weak queries and stays fixed for strong ones.
+
+    Strong queries (best match well above `threshold`) keep the fixed
+    threshold; weak queries accept results within `relative_margin` of
+    the best match, but never below `min_threshold`.
+    """
+    if len(similarities) == 0:
+        return threshold
+    top = float(np.max(similarities))
+    return float(np.clip(top - relative_margin, min_threshold, threshold))
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def mmr(query, embeddings, k, lambda_=0.7, relevance=None):
+    """Maximal marginal relevance: indices of k relevant but diverse rows.
+
+    `embeddings` is an (n, d) array. `relevance` defaults to cosine
+    similarity with `query`. Each pick maximises
+    lambda * relevance - (1 - lambda) * max similarity to picks so far.
+    """
+    embeddings = _normalize(np.asarray(embeddings, dtype=np.float32))
+    n = len(embeddings)
+    if n == 0 or k <= 0:
+        return []
+    if relevance is None:
+        relevance = embeddings @ _normalize(np.asarray(query, dtype=np.float32))
+    relevance = np.asarray(relevance, dtype=np.float32)
+
+    pairwise = embeddings @ embeddings.T
+    max_sim = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    picked = []
+    for _ in range(min(k, n)):
+        redundancy = np.where(np.isfinite(max_sim), max_sim, 0.0)
+        scores = lambda_ * relevance - (1 - lambda_) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        picked.append(best)
+        available[best] = False
+        max_sim = np.maximum(max_sim, pairwise[best])
+    return picked
+
+
+def rerank(rows, query_embedding, limit, settings=None):
+    """Apply the adaptive threshold and MMR to match_entries rows."""
+    settings = {**DEFAULT_SEARCH, **(settings or {})}
+    if not rows:
+        return []
+    similarities = np.array([row.get("similarity", 0.0) for row in rows], dtype=np.float32)
+    cutoff = adaptive_threshold(similarities, settings["threshold"],
+                                settings["min_threshold"], settings["relative_margin"])
+    rows = [row for row, sim in zip(rows, similarities) if sim >= cutoff]
+
+    vectors = [parse_embedding(row.get("embedding")) for row in rows]
+    if not rows or any(v is None for v in vectors):
+        return rows[:limit]
+    order = mmr(query_embedding, np.stack(vectors), limit, settings["mmr_lambda"],
+                relevance=[row["similarity"] for row in rows])
+    return [rows[i] for i in order]
+
+
+def fuse_rankings(ranked_lists, limit, k=60):
+    """Reciprocal rank fusion of result lists from different indexes.
+
+    Similarities from different embedding models are not comparable, so
+    rows are ordered by sum(1 / (k + rank)) instead.
+    """
+    if len(ranked_lists) == 1:
+        return ranked_lists[0][:limit]
+    scores = {}
+    rows = {}
+    for ranked in ranked_lists:
+        for rank, row in enumerate(ranked):
+            scores[row["id"]] = scores.get(row["id"], 0.0) + 1.0 / (k + rank + 1)
+            rows.setdefault(row["id"], row)
+    order = sorted(scores, key=lambda entry_id: -scores[entry_id])
+    return [rows[entry_id] for entry_id in order[:limit]]
@@ -0,0 +1,233 @@
+"""Deadlines, hedged requests and a circuit breaker for upstream model calls."""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+DEFAULT_SETTINGS = {
+    # Counted from when the call starts running, not from when it was queued
+    "deadline_s": 30.0,
+    # Worker threads per caller. Abandoned (timed out) calls keep a worker until
+    # the HTTP request itself gives up, so keep headroom over expected concurrency.
+    "max_workers": 32,
+    # How long a call may wait for a free worker; a local limit, not an upstream failure
+    "queue_timeout_s": 30.0,
+    "hedge": False,
+    # Send the duplicate after this percentile of recent latencies
+    "hedge_quantile": 95,
+    "hedge_min_delay_s": 0.5,
+    "hedge_min_samples": 20,
+    # Circuit breaker
+    "breaker_window": 20,
+    "breaker_failure_rate": 0.5,
+    "breaker_min_calls": 5,
+    "breaker_cooldown_s": 30.0,
+}
+
+
+class DeadlineExceeded(TimeoutError):
+    """The upstream call did not finish before its deadline."""
+
+
+class QueueTimeout(DeadlineExceeded):
+    """No local worker was free in time; the upstream was never called."""
+
+
+class CircuitOpenError(RuntimeError):
+    """The upstream is marked as degraded and the call was shed."""
+
+
+class CircuitBreaker:
+    """Open after too many recent failures, probe again after a cooldown.
+
+    allow() hands out a ticket to pass back to record() or release(). While
+    open, only the single half-open probe's result closes or reopens the
+    breaker; results of calls admitted before the last state change are
+    ignored, so a slow call from before a trip cannot close it.
+    """
+
+    def __init__(self, window=20, failure_rate=0.5, min_calls=5, cooldown_s=30.0):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.cooldown_s = cooldown_s
+        self._results = deque(maxlen=window)
+        self._opened_at = None
+        self._probing = False
+        # Bumped on every open and close; tickets from an older generation are stale
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.cooldown_s:
+            return "half-open"
+        return "open"
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self._probing = False
+        self._generation += 1
+
+    def allow(self):
+        """Return a ticket (generation, probe) if a call may go through now, else None."""
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return (self._generation, False)
+            if state == "half-open" and not self._probing:
+                # Let a single probe through
+                self._probing = True
+                return (self._generation, True)
+            return None
+
+    def release(self, ticket):
+        """Give back an allowed call that never reached the upstream."""
+        with self._lock:
+            if ticket[1] and ticket[0] == self._generation:
+                self._probing = False
+
+    def record(self, ticket, success):
+        generation, probe = ticket
+        with self._lock:
+            if generation != self._generation:
+                return
+            if self._opened_at is not None:
+                if not probe:
+                    return
+                if success:
+                    self._opened_at = None
+                    self._probing = False
+                    self._results.clear()
+                    self._generation += 1
+                else:
+                    self._open()
+                return
+            self._results.append(bool(success))
+            failures = self._results.count(False)
+            if (len(self._results) >= self.min_calls
+                    and failures / len(self._results) >= self.failure_rate):
+                self._open()
+
+
+class ResilientCaller:
+    """Run a blocking upstream call with a deadline, optional hedging and a breaker.
+
+    With hedging on, a duplicate request is sent once the first one has been
+    running longer than the recent p95 latency; whichever answers first wins.
+    Time spent waiting for one of this caller's workers does not count against
+    the deadline or the breaker; a call that waits longer than queue_timeout_s
+    raises QueueTimeout.
+    """
+
+    def __init__(self, name, settings=None):
+        self.name = name
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.settings.update(settings or {})
+        self.breaker = CircuitBreaker(
+            window=self.settings["breaker_window"],
+            failure_rate=self.settings["breaker_failure_rate"],
+            min_calls=self.settings["breaker_min_calls"],
+            cooldown_s=self.settings["breaker_cooldown_s"],
+        )
+        self._executor = ThreadPoolExecutor(max_workers=self.settings["max_workers"],
+                                            thread_name_prefix=f"upstream-{name}")
+        self._latencies = deque(maxlen=200)
+        self._counts = {"calls": 0, "timeouts": 0, "shed": 0, "hedged": 0, "hedge_wins": 0,
+                        "queue_timeouts": 0}
+        self._lock = threading.Lock()
+
+    def hedge_delay(self):
+        """Seconds to wait before sending a duplicate, or None to not hedge."""
+        if not self.settings["hedge"]:
+            return None
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < self.settings["hedge_min_samples"]:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * self.settings["hedge_quantile"] / 100))
+        return max(self.settings["hedge_min_delay_s"], samples[index])
+
+    def __call__(self, fn, *args, deadline_s=None, **kwargs):
+        ticket = self.breaker.allow()
+        if ticket is None:
+            self._count("shed")
+            raise CircuitOpenError(f"{self.name}: upstream degraded, try again shortly")
+        self._count("calls")
+
+        deadline_s = deadline_s or self.settings["deadline_s"]
+        started = threading.Event()
+        clock = []
+
+        def run():
+            if not started.is_set():
+                clock.append(time.monotonic())
+                started.set()
+            return fn(*args, **kwargs)
+
+        futures = [self._executor.submit(run)]
+        if not started.wait(self.settings["queue_timeout_s"]) and futures[0].cancel():
+            self._count("queue_timeouts")
+            self.breaker.release(ticket)
+            raise QueueTimeout(f"{self.name}: no free worker within {self.settings['queue_timeout_s']:.0f}s")
+        started.wait()
+        start = clock[0]
+        end = start + deadline_s
+
+        delay = self.hedge_delay()
+        if delay is not None and delay < deadline_s:
+            done, _ = wait(futures, timeout=max(0.0, start + delay - time.monotonic()))
+            if not done:
+                self._count("hedged")
+                futures.append(self._executor.submit(run))
+
+        error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, end - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if future is not futures[0]:
+                        self._count("hedge_wins")
+                    self._finish(ticket, start, success=True)
+                    return future.result()
+                error = future.exception()
+
+        if error is not None and not pending:
+            self._finish(ticket, start, success=False)
+            raise error
+        for future in pending:
+            future.cancel()
+        self._count("timeouts")
+        self._finish(ticket, start, success=False)
+        raise DeadlineExceeded(f"{self.name}: no response within {deadline_s:.0f}s")
+
+    def _count(self, key):
+        with self._lock:
+            self._counts[key] += 1
+
+    def _finish(self, ticket, start, success):
+        elapsed = time.monotonic() - start
+        if success:
+            with self._lock:
+                self._latencies.append(elapsed)
+        self.breaker.record(ticket, success)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+        stats["name"] = self.name
+        stats["breaker"] = self.breaker.state
+        delay = self.hedge_delay()
+        stats["hedge_after_ms"] = round(delay * 1000) if delay is not None else None
+        return stats
@@ -0,0 +1,18 @@
+"""Read the app's secrets.toml outside Streamlit (batch jobs and services)."""
+import os
+import tomllib
+
+from supabase import create_client
+
+DEFAULT_SECRETS_PATH = ".streamlit/secrets.toml"
+
+
+def load_secrets(path=None):
+    """Load secrets from KNOWLEDGEHUB_SECRETS or .streamlit/secrets.toml."""
+    path = path or os.environ.get("KNOWLEDGEHUB_SECRETS", DEFAULT_SECRETS_PATH)
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+def create_supabase(secrets):
+    return create_client(secrets["supabase"]["url"], secrets["supabase"]["key"])
@@ -0,0 +1,309 @@
+"""Columnar snapshot of entries with incremental change capture.
+
+    python snapshot.py                      # append rows changed since the last run
+    python snapshot.py --full               # rewrite the snapshot from scratch
+    python snapshot.py --compact            # merge parts, keep the latest row per id
+    python snapshot.py --format parquet     # also write Parquet next to the Arrow parts
+
+Each run writes one uncompressed Arrow IPC part (memory-mappable) with
+flattened analysis fields and embeddings as fixed-size float32 lists, and
+moves the updated_at/created_at watermark in _state.json forward. A trigger
+(entries_updated_at migration) sets updated_at on every relevant update.
+Deleted entries are only dropped by a --full run. The embedding width
+comes from [embeddings] dimensions (or the first vector seen); until one is
+known the embedding column is null-typed.
+
+Reading:
+
+    from snapshot import open_snapshot, embedding_matrix
+    table = open_snapshot("snapshot")          # memory-mapped, latest row per id
+    ids, matrix = embedding_matrix(table)      # (n, d) float32, a view after --compact
+
+Superseded rows are skipped with zero-copy slices of the mapped parts, so
+reading never copies columns; compacting keeps the number of slices small.
+"""
+import argparse
+import json
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+DEFAULT_DIR = "snapshot"
+STATE_FILE = "_state.json"
+PAGE_SIZE = 1000
+
+LIST_FIELDS = ("topics", "entities", "action_items", "key_points")
+TEXT_FIELDS = ("category", "summary", "sentiment")
+COLUMNS = ("id, user_id, created_at, updated_at, archived, file_type, file_name, content, "
+           "ai_analysis, embedding, embedding_model, embedding_version")
+
+
+def schema(dims):
+    return pa.schema([
+        ("id", pa.string()),
+        ("user_id", pa.string()),
+        ("created_at", pa.timestamp("us", tz="UTC")),
+        ("updated_at", pa.timestamp("us", tz="UTC")),
+        ("archived", pa.bool_()),
+        ("file_type", pa.string()),
+        ("file_name", pa.string()),
+        ("content", pa.string()),
+        ("category", pa.string()),
+        ("summary", pa.string()),
+        ("sentiment", pa.string()),
+        ("topics", pa.list_(pa.string())),
+        ("entities", pa.list_(pa.string())),
+        ("action_items", pa.list_(pa.string())),
+        ("key_points", pa.list_(pa.string())),
+        ("analysis_error", pa.string()),
+        ("ai_analysis", pa.string()),
+        ("embedding_model", pa.string()),
+        ("embedding_version", pa.int32()),
+        ("embedding", pa.list_(pa.float32(), dims) if dims else pa.null()),
+    ])
+
+
+def _timestamps(values):
+    return pa.array(pd.to_datetime(pd.Series(values, dtype="object"), utc=True, format="ISO8601"),
+                    type=pa.timestamp("us", tz="UTC"))
+
+
+def _strings(values):
+    return [None if v is None else [str(x) for x in v] if isinstance(v, list) else [str(v)] for v in values]
+
+
+def to_table(rows, dims):
+    """Flatten entry rows into an Arrow table with a fixed-size embedding column."""
+    analyses = [r.get("ai_analysis") or {} for r in rows]
+    columns = {
+        "id": [r["id"] for r in rows],
+        "user_id": [r.get("user_id") for r in rows],
+        "created_at": _timestamps([r.get("created_at") for r in rows]),
+        "updated_at": _timestamps([r.get("updated_at") for r in rows]),
+        "archived": [bool(r.get("archived")) for r in rows],
+        "file_type": [r.get("file_type") for r in rows],
+        "file_name": [r.get("file_name") for r in rows],
+        "content": [r.get("content") for r in rows],
+        "analysis_error": [a.get("error") for a in analyses],
+        "ai_analysis": [json.dumps(a, ensure_ascii=False) if a else None for a in analyses],
+        "embedding_model": [r.get("embedding_model") for r in rows],
+        "embedding_version": [r.get("embedding_version") for r in rows],
+    }
+    for field in TEXT_FIELDS:
+        columns[field] = [None if a.get(field) is None else str(a.get(field)) for a in analyses]
+    for field in LIST_FIELDS:
+        columns[field] = _strings([a.get(field) for a in analyses])
+
+    # Embeddings: one contiguous float32 buffer, rows without one are null
+    if dims:
+        flat = np.zeros((len(rows), dims), dtype=np.float32)
+        valid = np.zeros(len(rows), dtype=bool)
+        for i, r in enumerate(rows):
+            vector = _vector(r)
+            if vector is not None and len(vector) == dims:
+                flat[i] = vector
+                valid[i] = True
+        columns["embedding"] = pa.FixedSizeListArray.from_arrays(
+            pa.array(flat.ravel(), type=pa.float32()), dims, mask=pa.array(~valid))
+    else:
+        columns["embedding"] = pa.nulls(len(rows))
+
+    target = schema(dims)
+    return pa.table({name: pa.array(columns[name], type=target.field(name).type)
+                     if not isinstance(columns[name], pa.Array) else columns[name]
+                     for name in target.names}, schema=target)
+
+
+def _vector(row):
+    value = row.get("embedding")
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def _parts(directory):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(".arrow"))
+
+
+def open_snapshot(directory=DEFAULT_DIR):
+    """Memory-map all parts and keep the latest version of each entry.
+
+    Only the id columns are read into memory; the result is made of slices
+    of the mapped parts, in part order.
+    """
+    tables = []
+    for path in _parts(directory):
+        with pa.memory_map(path) as source:
+            tables.append(ipc.open_file(source).read_all())
+    if not tables:
+        return None
+    if len(tables) == 1:
+        return tables[0]
+    # Later parts win: keep the last occurrence of each id
+    ids = pa.chunked_array([t.column("id") for t in tables])
+    last = (pa.table({"id": ids, "_row": np.arange(len(ids))})
+            .group_by("id").aggregate([("_row", "max")]).column("_row_max").to_numpy())
+    keep = np.zeros(len(ids), dtype=bool)
+    keep[last] = True
+    pieces, offset = [], 0
+    for table in tables:
+        mask = keep[offset:offset + len(table)]
+        offset += len(table)
+        if mask.all():
+            pieces.append(table)
+            continue
+        # Runs of kept rows as zero-copy slices
+        edges = np.flatnonzero(np.diff(np.concatenate([[0], mask.astype(np.int8), [0]])))
+        pieces += [table.slice(start, end - start) for start, end in zip(edges[::2], edges[1::2])]
+    # Parts written before the embedding width was known have a null-typed column
+    return pa.concat_tables(pieces, promote_options="default")
+
+
+def embedding_matrix(table):
+    """(ids, (n, d) float32 matrix) for rows with an embedding.
+
+    A view of the mapped file when the table is one slice with every
+    embedding present (a compacted snapshot); otherwise the vectors are copied.
+    """
+    if pa.types.is_null(table.schema.field("embedding").type):
+        return [], np.zeros((0, 0), dtype=np.float32)
+    dims = table.schema.field("embedding").type.list_size
+    ids, blocks = [], []
+    for batch in table.select(["id", "embedding"]).to_batches():
+        column = batch.column("embedding")
+        values = column.values.to_numpy(zero_copy_only=False)
+        values = values[column.offset * dims:(column.offset + len(column)) * dims].reshape(-1, dims)
+        batch_ids = batch.column("id").to_pylist()
+        if column.null_count:
+            valid = column.is_valid().to_numpy(zero_copy_only=False)
+            values, batch_ids = values[valid], [i for i, v in zip(batch_ids, valid) if v]
+        ids += batch_ids
+        blocks.append(values)
+    if not blocks:
+        return [], np.zeros((0, dims), dtype=np.float32)
+    return ids, blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+
+
+class SnapshotExporter:
+    """Write entries to memory-mappable Arrow parts, appending only changes."""
+
+    def __init__(self, supabase, directory=DEFAULT_DIR, log=print, dims=None):
+        self.supabase = supabase
+        self.directory = directory
+        self.log = log
+        # Expected embedding width, from [embeddings] dimensions
+        self.dims = dims
+
+    def _state_path(self):
+        return os.path.join(self.directory, STATE_FILE)
+
+    def load_state(self):
+        try:
+            with open(self._state_path()) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"watermark": None, "dims": None, "parts": 0, "rows": 0}
+
+    def _save_state(self, state):
+        with open(self._state_path(), "w") as f:
+            json.dump(state, f, indent=2)
+
+    def _fetch_changed(self, watermark):
+        rows, start = [], 0
+        while True:
+            query = self.supabase.table("entries").select(COLUMNS)
+            if watermark:
+                query = query.or_(f"updated_at.gt.\"{watermark}\",created_at.gt.\"{watermark}\"")
+            page = query.order("id").range(start, start + PAGE_SIZE - 1).execute().data
+            rows.extend(page)
+            if len(page) < PAGE_SIZE:
+                return rows
+            start += PAGE_SIZE
+
+    def export(self, full=False, parquet=False):
+        """Append a part with rows changed since the watermark. Returns row count."""
+        os.makedirs(self.directory, exist_ok=True)
+        state = self.load_state()
+        if full:
+            for path in _parts(self.directory):
+                os.remove(path)
+            state = {"watermark": None, "dims": None, "parts": 0, "rows": 0}
+
+        rows = self._fetch_changed(state["watermark"])
+        if not rows:
+            self.log("No changes since last export")
+            return 0
+        vectors = [v for v in map(_vector, rows) if v is not None]
+        dims = self.dims or state["dims"] or (len(vectors[0]) if vectors else None)
+        if state["dims"] and dims != state["dims"]:
+            raise ValueError(f"Snapshot has {state['dims']}-dim embeddings, config says {dims}; run with --full")
+        mismatched = sum(1 for v in vectors if len(v) != dims)
+        if mismatched:
+            self.log(f"Skipped {mismatched} embeddings that are not {dims}-dimensional")
+        table = to_table(rows, dims)
+
+        name = f"part-{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}"
+        with pa.OSFile(os.path.join(self.directory, name + ".arrow"), "wb") as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        if parquet:
+            import pyarrow.parquet as pq
+            pq.write_table(table, os.path.join(self.directory, name + ".parquet"))
+
+        stamps = [r.get("updated_at") or r.get("created_at") for r in rows]
+        stamps += [r.get("created_at") for r in rows]
+        state.update({
+            "watermark": max(s for s in stamps if s),
+            "dims": dims,
+            "parts": state["parts"] + 1,
+            "rows": state["rows"] + len(rows),
+            "exported_at": datetime.now(timezone.utc).isoformat(),
+        })
+        self._save_state(state)
+        self.log(f"Wrote {len(rows)} rows to {name}.arrow")
+        return len(rows)
+
+    def compact(self):
+        """Merge all parts into one, keeping the latest row per id."""
+        parts = _parts(self.directory)
+        if len(parts) < 2:
+            return
+        table = open_snapshot(self.directory)
+        path = os.path.join(self.directory, f"part-{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}.arrow")
+        with pa.OSFile(path, "wb") as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        for old in parts:
+            os.remove(old)
+        state = self.load_state()
+        state.update({"parts": 1, "rows": len(table)})
+        self._save_state(state)
+        self.log(f"Compacted {len(parts)} parts into {len(table)} rows")
+
+
+def main():
+    from settings import create_supabase, load_secrets
+
+    parser = argparse.ArgumentParser(description="Export entries to a columnar snapshot")
+    parser.add_argument("--dir", default=DEFAULT_DIR, help="snapshot directory")
+    parser.add_argument("--full", action="store_true", help="rewrite instead of appending changes")
+    parser.add_argument("--compact", action="store_true", help="merge parts after exporting")
+    parser.add_argument("--format", choices=["arrow", "parquet"], default="arrow",
+                        help="parquet also writes a .parquet copy of each part")
+    parser.add_argument("--secrets", help="path to secrets.toml")
+    args = parser.parse_args()
+
+    secrets = load_secrets(args.secrets)
+    exporter = SnapshotExporter(create_supabase(secrets), args.dir,
+                                dims=secrets.get("embeddings", {}).get("dimensions"))
+    exporter.export(full=args.full, parquet=args.format == "parquet")
+    if args.compact:
+        exporter.compact()
+
+
+if __name__ == "__main__":
+    main()
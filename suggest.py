@@ -0,0 +1,159 @@
+"""In-memory prefix index over topics, entities and categories.
+
+Terms live in one sorted list of lowercased keys, so a lookup is a bisect
+plus a scan of the matching slice - well under a millisecond for tens of
+thousands of terms, with no embedding call. Multi-word terms are also
+keyed from each word, so "learn" finds "Machine learning". Terms are
+matched case-insensitively; each keeps the spellings entries use
+("variants") so callers can filter on all of them. The index is built once
+from all entries and then updated per entry (add_entry / remove_entry),
+e.g. from the change feed.
+"""
+import bisect
+import heapq
+import re
+import threading
+from collections import Counter
+from itertools import islice
+
+# ai_analysis field -> suggestion kind
+FIELDS = {"category": "category", "topics": "topic", "entities": "entity"}
+KINDS = tuple(FIELDS.values())
+# Ranked matches of prefixes up to this length are cached until the next change
+SHORT_PREFIX = 2
+CACHED_MATCHES = 50
+
+_WORD_START = re.compile(r"(?<!\w)\w")
+
+
+def normalize(text):
+    return " ".join(str(text).casefold().split())
+
+
+def terms_of(ai_analysis):
+    """(kind, term) pairs in one entry's analysis."""
+    ai = ai_analysis or {}
+    terms = set()
+    for field, kind in FIELDS.items():
+        values = ai.get(field)
+        if isinstance(values, str):
+            values = [values]
+        for value in values or []:
+            if isinstance(value, str) and value.strip():
+                terms.add((kind, value.strip()))
+    return terms
+
+
+class SuggestIndex:
+    """Prefix lookup of known terms, ranked by how many entries use them. Thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = []     # sorted (key, kind, term) - key is the term or a word-suffix of it
+        self._terms = {}    # (kind, term) -> [Counter of spellings, entry count]
+        self._entries = {}  # entry_id -> {(kind, term): spelling}
+        self._popular = None  # all terms by count, for empty prefixes
+        self._short = {}    # (prefix, kinds) -> best CACHED_MATCHES terms
+
+    @classmethod
+    def build(cls, rows):
+        """Index rows with id and ai_analysis, sorting the keys once."""
+        index = cls()
+        with index._lock:
+            for row in rows:
+                index._keys.extend(index._add_locked(row["id"], row.get("ai_analysis")))
+            index._keys.sort()
+        return index
+
+    def __len__(self):
+        return len(self._terms)
+
+    @staticmethod
+    def _keys_for(kind, term):
+        return [(term[m.start():], kind, term) for m in _WORD_START.finditer(term)]
+
+    def add_entry(self, entry_id, ai_analysis):
+        """Index (or re-index) one entry's terms."""
+        with self._lock:
+            for key in self._add_locked(entry_id, ai_analysis):
+                bisect.insort(self._keys, key)
+
+    def _add_locked(self, entry_id, ai_analysis):
+        """Count the entry's terms; returns keys for terms new to the index."""
+        terms = {}
+        for kind, text in terms_of(ai_analysis):
+            terms.setdefault((kind, normalize(text)), text)
+        self._remove_locked(entry_id)
+        self._entries[entry_id] = terms
+        self._changed()
+        new_keys = []
+        for (kind, term), text in terms.items():
+            known = self._terms.get((kind, term))
+            if known:
+                known[0][text] += 1
+                known[1] += 1
+            else:
+                self._terms[(kind, term)] = [Counter({text: 1}), 1]
+                new_keys.extend(self._keys_for(kind, term))
+        return new_keys
+
+    def _changed(self):
+        self._popular = None
+        self._short.clear()
+
+    def remove_entry(self, entry_id):
+        with self._lock:
+            self._remove_locked(entry_id)
+
+    def _remove_locked(self, entry_id):
+        removed = self._entries.pop(entry_id, {})
+        if removed:
+            self._changed()
+        for (kind, term), text in removed.items():
+            known = self._terms[(kind, term)]
+            known[0][text] -= 1
+            if known[0][text] <= 0:
+                del known[0][text]
+            known[1] -= 1
+            if known[1] > 0:
+                continue
+            del self._terms[(kind, term)]
+            for key in self._keys_for(kind, term):
+                i = bisect.bisect_left(self._keys, key)
+                if i < len(self._keys) and self._keys[i] == key:
+                    del self._keys[i]
+
+    def suggest(self, prefix, limit=8, kinds=None):
+        """Terms matching prefix as [{"text", "kind", "count", "variants"}], best first.
+
+        Terms that start with the prefix rank above terms where only a later
+        word does; then by entry count. An empty prefix gives the most used
+        terms. text is the most used spelling, variants all spellings in use.
+        """
+        prefix = normalize(prefix)
+        kinds = frozenset(kinds or KINDS)
+        with self._lock:
+            if not prefix:
+                if self._popular is None:
+                    self._popular = sorted(self._terms, key=lambda t: (-self._terms[t][1], len(t[1])))
+                best = list(islice((t for t in self._popular if t[0] in kinds), limit))
+            elif len(prefix) <= SHORT_PREFIX and limit <= CACHED_MATCHES:
+                if (prefix, kinds) not in self._short:
+                    self._short[(prefix, kinds)] = self._rank(prefix, kinds, CACHED_MATCHES)
+                best = self._short[(prefix, kinds)][:limit]
+            else:
+                best = self._rank(prefix, kinds, limit)
+            return [self._suggestion(t) for t in best]
+
+    def _rank(self, prefix, kinds, limit):
+        """Best terms over every key that starts with prefix."""
+        start = bisect.bisect_left(self._keys, (prefix,))
+        end = bisect.bisect_left(self._keys, (prefix + "\U0010ffff",), start)
+        matches = {(kind, term) for _, kind, term in self._keys[start:end] if kind in kinds}
+        return heapq.nlargest(limit, matches, key=lambda t: (
+            t[1].startswith(prefix), self._terms[t][1], -len(t[1])))
+
+    def _suggestion(self, key):
+        variants, count = self._terms[key]
+        return {"text": variants.most_common(1)[0][0], "kind": key[0], "count": count,
+                "variants": sorted(variants)}
@@ -0,0 +1,55 @@
+-- Semantic search with filters applied in the database, so archived or
+-- out-of-scope rows do not use up the match_count budget.
+-- Also returns the embedding so the app can diversify results (MMR).
+
+create or replace function match_entries_filtered(
+  query_embedding vector,
+  match_threshold float default 0.5,
+  match_count int default 40,
+  include_archived boolean default false,
+  filter_category text default null,
+  filter_file_type text default null,
+  created_after timestamptz default null,
+  created_before timestamptz default null,
+  filter_user_id uuid default null
+)
+returns table (
+  id uuid,
+  user_id uuid,
+  content text,
+  ai_analysis jsonb,
+  file_type text,
+  file_name text,
+  created_at timestamptz,
+  archived boolean,
+  embedding vector,
+  similarity float
+)
+language sql stable
+as $$
+  select
+    e.id,
+    e.user_id,
+    e.content,
+    e.ai_analysis,
+    e.file_type,
+    e.file_name,
+    e.created_at,
+    e.archived,
+    e.embedding,
+    1 - (e.embedding <=> query_embedding) as similarity
+  from entries e
+  where e.embedding is not null
+    and (include_archived or not coalesce(e.archived, false))
+    and (filter_category is null or e.ai_analysis->>'category' = filter_category)
+    and (filter_file_type is null or e.file_type = filter_file_type)
+    and (created_after is null or e.created_at >= created_after)
+    and (created_before is null or e.created_at < created_before)
+    and (filter_user_id is null or e.user_id = filter_user_id)
+    and 1 - (e.embedding <=> query_embedding) > match_threshold
+  order by e.embedding <=> query_embedding
+  limit match_count;
+$$;
+
+create index if not exists entries_category_idx on entries ((ai_analysis->>'category'));
+create index if not exists entries_created_at_idx on entries (created_at desc);
@@ -0,0 +1,8 @@
+-- Near-duplicate handling at ingest.
+-- duplicate_of: set on entries saved with the "link" action
+-- duplicate_count: bumped on the original with the "merge" action
+
+alter table entries add column if not exists duplicate_of uuid references entries(id) on delete set null;
+alter table entries add column if not exists duplicate_count int not null default 0;
+
+create index if not exists entries_duplicate_of_idx on entries (duplicate_of);
@@ -0,0 +1,106 @@
+-- Versioned embeddings and zero-downtime re-embedding.
+--
+-- embedding / embedding_model / embedding_version: the index search reads today
+-- embedding_next / embedding_next_*: backfilled by the re-embedder for a new model
+--
+-- Migration steps:
+--   1. Set next_model/next_version under [embeddings]; new saves write both columns
+--   2. Start the re-embedder on the Admin page and wait for it to finish
+--   3. Set read = "next" (search reads only embedding_next)
+--   4. select promote_embedding_next('<model>', <version>);
+--      then set model/version to the new spec and remove next_* and read
+-- If the new model has a different dimension, the embedding column (and any
+-- vector index on it) must be untyped or recreated before step 4.
+
+alter table entries add column if not exists embedding_model text;
+alter table entries add column if not exists embedding_version int;
+alter table entries add column if not exists embedding_next vector;
+alter table entries add column if not exists embedding_next_model text;
+alter table entries add column if not exists embedding_next_version int;
+
+update entries
+set embedding_model = 'models/gemini-embedding-001', embedding_version = 1
+where embedding is not null and embedding_model is null;
+
+create table if not exists embedding_migrations (
+  target text primary key,
+  cursor uuid,
+  processed int not null default 0,
+  failed int not null default 0,
+  done boolean not null default false,
+  updated_at timestamptz default now()
+);
+
+-- Same as before, plus use_next to search the embedding_next column
+drop function if exists match_entries_filtered(vector, float, int, boolean, text, text, timestamptz, timestamptz, uuid);
+
+create or replace function match_entries_filtered(
+  query_embedding vector,
+  match_threshold float default 0.5,
+  match_count int default 40,
+  include_archived boolean default false,
+  filter_category text default null,
+  filter_file_type text default null,
+  created_after timestamptz default null,
+  created_before timestamptz default null,
+  filter_user_id uuid default null,
+  use_next boolean default false
+)
+returns table (
+  id uuid,
+  user_id uuid,
+  content text,
+  ai_analysis jsonb,
+  file_type text,
+  file_name text,
+  created_at timestamptz,
+  archived boolean,
+  embedding vector,
+  similarity float
+)
+language sql stable
+as $$
+  select
+    e.id,
+    e.user_id,
+    e.content,
+    e.ai_analysis,
+    e.file_type,
+    e.file_name,
+    e.created_at,
+    e.archived,
+    v.vec as embedding,
+    1 - (v.vec <=> query_embedding) as similarity
+  from entries e
+  cross join lateral (
+    select case when use_next then e.embedding_next else e.embedding end as vec
+  ) v
+  where v.vec is not null
+    and (include_archived or not coalesce(e.archived, false))
+    and (filter_category is null or e.ai_analysis->>'category' = filter_category)
+    and (filter_file_type is null or e.file_type = filter_file_type)
+    and (created_after is null or e.created_at >= created_after)
+    and (created_before is null or e.created_at < created_before)
+    and (filter_user_id is null or e.user_id = filter_user_id)
+    and 1 - (v.vec <=> query_embedding) > match_threshold
+  order by v.vec <=> query_embedding
+  limit match_count;
+$$;
+
+-- Copy the backfilled vectors into the main column. embedding_next is kept
+-- so searches with read = "next" keep working until the config is switched.
+create or replace function promote_embedding_next(target_model text, target_version int)
+returns int
+language sql
+as $$
+  with promoted as (
+    update entries
+    set embedding = embedding_next,
+        embedding_model = embedding_next_model,
+        embedding_version = embedding_next_version
+    where embedding_next_model = target_model
+      and embedding_next_version = target_version
+    returning 1
+  )
+  select count(*)::int from promoted;
+$$;
@@ -0,0 +1,42 @@
+-- Precomputed related-entries graph and topic clusters (see entry_graph.py).
+
+create table if not exists entry_neighbors (
+  entry_id uuid primary key references entries(id) on delete cascade,
+  neighbor_ids uuid[] not null default '{}',
+  similarities real[] not null default '{}',
+  updated_at timestamptz default now()
+);
+
+create table if not exists topic_clusters (
+  cluster_id int primary key,
+  label text,
+  top_topics text[] not null default '{}',
+  size int not null default 0,
+  centroid vector,
+  updated_at timestamptz default now()
+);
+
+create table if not exists entry_clusters (
+  entry_id uuid primary key references entries(id) on delete cascade,
+  cluster_id int not null,
+  similarity real,
+  updated_at timestamptz default now()
+);
+
+create index if not exists entry_clusters_cluster_idx on entry_clusters (cluster_id);
+
+create table if not exists graph_runs (
+  id bigint generated always as identity primary key,
+  kind text not null,
+  watermark timestamptz,
+  entries int not null default 0,
+  finished_at timestamptz default now()
+);
+
+create or replace function refresh_cluster_sizes()
+returns void
+language sql
+as $$
+  update topic_clusters t
+  set size = coalesce((select count(*) from entry_clusters c where c.cluster_id = t.cluster_id), 0);
+$$;
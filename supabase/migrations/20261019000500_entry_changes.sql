@@ -0,0 +1,59 @@
+-- Outbox of entry changes, consumed by changefeed.py to invalidate caches and indexes.
+-- Updates that only touch embeddings or counters are not recorded.
+
+create table if not exists entry_changes (
+  id bigint generated always as identity primary key,
+  entry_id uuid not null,
+  op text not null check (op in ('insert', 'update', 'delete')),
+  changed_at timestamptz not null default now()
+);
+
+create index if not exists entry_changes_changed_at_idx on entry_changes (changed_at);
+
+create or replace function record_entry_change()
+returns trigger
+language plpgsql
+as $$
+begin
+  if tg_op = 'DELETE' then
+    insert into entry_changes (entry_id, op) values (old.id, 'delete');
+    return old;
+  end if;
+  insert into entry_changes (entry_id, op) values (new.id, lower(tg_op));
+  return new;
+end;
+$$;
+
+drop trigger if exists entries_change_insert on entries;
+create trigger entries_change_insert
+  after insert on entries
+  for each row execute function record_entry_change();
+
+drop trigger if exists entries_change_update on entries;
+create trigger entries_change_update
+  after update on entries
+  for each row
+  when (
+    old.content is distinct from new.content
+    or old.ai_analysis is distinct from new.ai_analysis
+    or old.archived is distinct from new.archived
+    or old.file_type is distinct from new.file_type
+    or old.file_name is distinct from new.file_name
+  )
+  execute function record_entry_change();
+
+drop trigger if exists entries_change_delete on entries;
+create trigger entries_change_delete
+  after delete on entries
+  for each row execute function record_entry_change();
+
+-- Consumers only read recent rows; run periodically (e.g. pg_cron) to keep the table small
+create or replace function prune_entry_changes(keep interval default interval '7 days')
+returns integer
+language sql
+as $$
+  with deleted as (
+    delete from entry_changes where changed_at < now() - keep returning 1
+  )
+  select count(*)::int from deleted;
+$$;
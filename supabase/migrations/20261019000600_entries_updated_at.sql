@@ -0,0 +1,34 @@
+-- Keep entries.updated_at current for every write, not only edits from the web app,
+-- so incremental snapshots (snapshot.py) pick up archives, re-analyses and backfilled
+-- embeddings. Counter updates (duplicate_count) and embedding_next backfills do not
+-- change what a snapshot holds and leave updated_at alone.
+
+alter table entries add column if not exists updated_at timestamptz default now();
+
+create index if not exists entries_updated_at_idx on entries (updated_at);
+
+create or replace function touch_entry_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+  new.updated_at := now();
+  return new;
+end;
+$$;
+
+drop trigger if exists entries_touch_updated_at on entries;
+create trigger entries_touch_updated_at
+  before update on entries
+  for each row
+  when (
+    old.content is distinct from new.content
+    or old.ai_analysis is distinct from new.ai_analysis
+    or old.archived is distinct from new.archived
+    or old.file_type is distinct from new.file_type
+    or old.file_name is distinct from new.file_name
+    or old.embedding is distinct from new.embedding
+    or old.embedding_model is distinct from new.embedding_model
+    or old.embedding_version is distinct from new.embedding_version
+  )
+  execute function touch_entry_updated_at();
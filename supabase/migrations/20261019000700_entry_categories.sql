@@ -0,0 +1,13 @@
+-- Distinct AI categories for the Search filter, without reading every row through PostgREST.
+-- Returned as one array so the PostgREST row limit does not apply. The category
+-- expression index is created with match_entries_filtered (20261019000100).
+
+create or replace function entry_categories()
+returns text[]
+language sql
+stable
+as $$
+  select coalesce(array_agg(distinct ai_analysis->>'category' order by ai_analysis->>'category'), '{}')
+  from entries
+  where coalesce(ai_analysis->>'category', '') <> '';
+$$;
@@ -0,0 +1,11 @@
+-- Atomic counter for the "merge" dedupe action: concurrent ingests of the same
+-- duplicate must not overwrite each other's increment.
+
+create or replace function increment_duplicate_count(target_id uuid)
+returns integer
+language sql
+as $$
+  update entries set duplicate_count = duplicate_count + 1
+  where id = target_id
+  returning duplicate_count;
+$$;
@@ -0,0 +1,68 @@
+-- match_entries_filtered from the versioned_embeddings migration ordered by a
+-- CASE over embedding / embedding_next, which no ivfflat/hnsw index can serve,
+-- so every search was a sequential scan. Each branch now orders by a bare column.
+
+create or replace function match_entries_filtered(
+  query_embedding vector,
+  match_threshold float default 0.5,
+  match_count int default 40,
+  include_archived boolean default false,
+  filter_category text default null,
+  filter_file_type text default null,
+  created_after timestamptz default null,
+  created_before timestamptz default null,
+  filter_user_id uuid default null,
+  use_next boolean default false
+)
+returns table (
+  id uuid,
+  user_id uuid,
+  content text,
+  ai_analysis jsonb,
+  file_type text,
+  file_name text,
+  created_at timestamptz,
+  archived boolean,
+  embedding vector,
+  similarity float
+)
+language plpgsql stable
+as $$
+begin
+  if use_next then
+    return query
+    select
+      e.id, e.user_id, e.content, e.ai_analysis, e.file_type, e.file_name, e.created_at, e.archived,
+      e.embedding_next as embedding,
+      1 - (e.embedding_next <=> query_embedding) as similarity
+    from entries e
+    where e.embedding_next is not null
+      and (include_archived or not coalesce(e.archived, false))
+      and (filter_category is null or e.ai_analysis->>'category' = filter_category)
+      and (filter_file_type is null or e.file_type = filter_file_type)
+      and (created_after is null or e.created_at >= created_after)
+      and (created_before is null or e.created_at < created_before)
+      and (filter_user_id is null or e.user_id = filter_user_id)
+      and 1 - (e.embedding_next <=> query_embedding) > match_threshold
+    order by e.embedding_next <=> query_embedding
+    limit match_count;
+  else
+    return query
+    select
+      e.id, e.user_id, e.content, e.ai_analysis, e.file_type, e.file_name, e.created_at, e.archived,
+      e.embedding,
+      1 - (e.embedding <=> query_embedding) as similarity
+    from entries e
+    where e.embedding is not null
+      and (include_archived or not coalesce(e.archived, false))
+      and (filter_category is null or e.ai_analysis->>'category' = filter_category)
+      and (filter_file_type is null or e.file_type = filter_file_type)
+      and (created_after is null or e.created_at >= created_after)
+      and (created_before is null or e.created_at < created_before)
+      and (filter_user_id is null or e.user_id = filter_user_id)
+      and 1 - (e.embedding <=> query_embedding) > match_threshold
+    order by e.embedding <=> query_embedding
+    limit match_count;
+  end if;
+end;
+$$;
@@ -0,0 +1,36 @@
+-- Let a writer recognise its own outbox rows. The insert and update triggers now
+-- run before the write and stamp entries.change_seq with the entry_changes id,
+-- which PostgREST returns with the written row; changefeed.py drops exactly those
+-- ids from the poll instead of guessing echoes by entry and time. A write that
+-- changes no tracked column records no row and keeps its old change_seq.
+
+alter table entries add column if not exists change_seq bigint;
+
+create or replace function stamp_entry_change()
+returns trigger
+language plpgsql
+as $$
+begin
+  insert into entry_changes (entry_id, op) values (new.id, lower(tg_op))
+  returning id into new.change_seq;
+  return new;
+end;
+$$;
+
+drop trigger if exists entries_change_insert on entries;
+create trigger entries_change_insert
+  before insert on entries
+  for each row execute function stamp_entry_change();
+
+drop trigger if exists entries_change_update on entries;
+create trigger entries_change_update
+  before update on entries
+  for each row
+  when (
+    old.content is distinct from new.content
+    or old.ai_analysis is distinct from new.ai_analysis
+    or old.archived is distinct from new.archived
+    or old.file_type is distinct from new.file_type
+    or old.file_name is distinct from new.file_name
+  )
+  execute function stamp_entry_change();
@@ -0,0 +1,7 @@
+-- Incremental graph refreshes (entry_graph.py) resume from the entry_changes outbox
+-- id instead of a created_at watermark, so they also see updated entries and do not
+-- depend on client clocks.
+
+alter table graph_runs add column if not exists change_seq bigint;
+
+create index if not exists graph_runs_change_seq_idx on graph_runs (change_seq);
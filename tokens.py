@@ -0,0 +1,76 @@
+"""Local token counting and token-budgeted splitting of long content."""
+import math
+import re
+
+# Word pieces, single punctuation marks and newlines. SentencePiece-style
+# tokenizers (Gemini, Gemma) split long words into ~4 character pieces.
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]|\n")
+_CHARS_PER_PIECE = 4
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+# Attachment headers added by the Add page, e.g. "[PDF: report.pdf]"
+_ATTACHMENT_RE = re.compile(r"\n\n(?=\[[A-Z]+: [^\]\n]+\]\n)")
+
+
+def _word_tokens(word):
+    return max(1, math.ceil(len(word) / _CHARS_PER_PIECE))
+
+
+def count_tokens(text):
+    """Estimate the model token count of text without an API call."""
+    if not text:
+        return 0
+    return sum(_word_tokens(m.group()) for m in _TOKEN_RE.finditer(text))
+
+
+def truncate_tokens(text, max_tokens):
+    """Cut text to at most max_tokens, at a token boundary."""
+    if not text:
+        return text
+    total = 0
+    for match in _TOKEN_RE.finditer(text):
+        total += _word_tokens(match.group())
+        if total > max_tokens:
+            return text[:match.start()].rstrip()
+    return text
+
+
+def _pieces(text, max_tokens):
+    """Yield pieces of text no longer than max_tokens, splitting coarsest first."""
+    if count_tokens(text) <= max_tokens:
+        yield text
+        return
+    for pattern in (_ATTACHMENT_RE, _PARAGRAPH_RE, _SENTENCE_RE):
+        parts = [p for p in pattern.split(text) if p.strip()]
+        if len(parts) > 1:
+            for part in parts:
+                yield from _pieces(part, max_tokens)
+            return
+    # One very long sentence: hard cut at token boundaries
+    while text:
+        head = truncate_tokens(text, max_tokens)
+        if not head:
+            head = text[:max_tokens * _CHARS_PER_PIECE]
+        yield head
+        text = text[len(head):].lstrip()
+
+
+def split_sections(text, max_tokens):
+    """Split text into sections of at most max_tokens each.
+
+    Prefers attachment, paragraph and sentence boundaries and packs
+    neighbouring pieces together so sections are close to the budget.
+    """
+    sections = []
+    current, current_tokens = [], 0
+    for piece in _pieces(text, max_tokens):
+        tokens = count_tokens(piece)
+        if current and current_tokens + tokens > max_tokens:
+            sections.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        sections.append("\n\n".join(current))
+    return sections